@@ -29,7 +29,10 @@
 
 import logging
 import time
-from threading import Thread
+from threading import (
+    Event,
+    Thread,
+)
 from typing import (
     Optional,
     TYPE_CHECKING,
@@ -58,6 +61,9 @@ class AutoPlayer:
         self.fps: float = fps
         self.playing = False
         self.thread: Optional[Thread] = None
+        # Set while advancing to the next frame, but not while waiting
+        # between frames, so the timeline's cache daemon can use that time.
+        self.busy = Event()
 
         logger.debug("Initialized.")
 
@@ -80,8 +86,12 @@ class AutoPlayer:
                 last_update_time = time.time()
 
                 logger.debug("Timeline slider +1...")
-                self.timeline_slider.add(1)
+                self.busy.set()
+                # Frames are paced by the frame rate, so they must not wait
+                # for a burst to settle like a slider drag does.
+                self.timeline_slider.add(1, settle=False)
                 self.volume_updater.wait_for_volume_update()
+                self.busy.clear()
 
                 update_delta_time = time.time() - last_update_time
                 if self.fps <= 0:
@@ -95,4 +105,5 @@ class AutoPlayer:
                     remaining_time -= sleep_time
             logger.info("Thread finished.")
         except RuntimeError as e:
+            self.busy.clear()
             logger.exception(f"Thread error: {e}")
@@ -170,6 +170,8 @@ class MainWindow(QMainWindow):
         self.ui.action_screenshot.setShortcut("Ctrl+R")
         self.ui.action_render_settings.triggered.connect(self.on_show_render_settings)
 
+        self.ui.action_narrow_to_uint8.toggled.connect(self.on_toggle_narrow_to_uint8)
+
         self.ui.action_acknowledgements.triggered.connect(self.on_show_acknowledgements)
         self.ui.action_project.triggered.connect(on_go_to_project_page)
         self.ui.action_version.triggered.connect(self.on_show_version)
@@ -315,6 +317,11 @@ class MainWindow(QMainWindow):
         self.dialog_render_settings = DialogRenderSettings(self, self.view_frame)
         self.dialog_render_settings.open()
 
+    def on_toggle_narrow_to_uint8(self, checked: bool) -> None:
+        """Respond to the action to store 8-bit data in 16-bit volumes compactly."""
+
+        self.timeline.narrow_to_uint8 = checked
+
     def on_show_acknowledgements(self, _: bool = False) -> None:
         """Respond to the action to show the acknowledgements."""
 
@@ -29,6 +29,8 @@
 
 import logging
 from threading import (
+    Condition,
+    Event,
     Lock,
     Thread,
 )
@@ -53,98 +55,110 @@ class MaskUpdater:
         self.mask = mask
         self.view_frame = view_frame
 
-        # This is the thread that performs an update. When it finishes, it
-        # is destroyed and a new thread is eventually created.
-        self.thread: Optional[Thread] = None
-        # This lock prevents race conditions related to both multiple
-        # threads starting up, and the must_update flag from being set
-        # when there is no living thread to carry out the request indicated.
+        # This lock guards the must_update flag and the mesh actor. The
+        # update thread waits on the condition for new requests. Only hold
+        # it while checking or setting those, since it has the potential to
+        # freeze the UI thread.
         self.lock = Lock()
+        self.cv = Condition(self.lock)
 
         self.do_render: bool = False
         self.must_update: bool = False
+        # Set while there is no pending request and the thread has finished
+        # the last one. Returned by queue so the caller can wait on it.
+        self.idle = Event()
+        self.idle.set()
 
         self.show_mesh: bool = False
         self.mesh_actor: Optional[vtkActor] = None
 
+        # The thread that performs the mask updates. It lives for the whole
+        # session and sleeps while there is nothing to do, so there is no
+        # thread start-up cost for each update, and there is never more than
+        # one mask being built at a time.
+        self.thread = Thread(target=self._run_thread, daemon=True)
+        self.thread.start()
         logger.debug("Initialized.")
 
-    def queue(self, do_render: bool) -> Thread:
+    def queue(self, do_render: bool) -> Event:
         """Indicates that an update is needed and returns immediately.
 
         When a mask update is requested while the previous update has yet
         to complete, this function indicates that a new update is needed and
         returns immediately to avoid bogging down the main loop with volume
-        loading operations.
+        loading operations. Requests made during an update are merged into
+        a single update once it completes.
 
-        This is the only function that is allowed to start the mask
-        updater thread. The mask updater thread can also recursively run
-        itself if still needed, as indicated by the must_update flag.
+        Returns an event that is set once the mask updater goes idle.
         """
 
-        # Use a lock so multiple queue requests don't race to create the
-        # update thread.
-        with self.lock:
+        with self.cv:
             self.do_render = do_render
             self.must_update = True
-
-            if not (self.thread and self.thread.is_alive()):
-                logger.info("New thread.")
-                # There is no thread, so start one.
-                self.thread = Thread(
-                    target=self._run_thread,
-                    daemon=True
-                )
-                self.thread.start()
-            else:
-                logger.info("Set the flag and returned.")
-
-        return self.thread
+            self.idle.clear()
+            self.cv.notify_all()
+        logger.info("Set the flag and returned.")
+        return self.idle
 
     def _run_thread(self) -> None:
-        """The loop for the mask update thread.
+        """The loop for the mask update thread."""
 
-        This method will hold lock for as little time as possible since
-        this lock has the potential to freeze the UI thread. It should only
-        be held while checking and setting the must_update flag.
+        try:
+            while True:
+                with self.cv:
+                    self.cv.wait_for(lambda: self.must_update)
+                    try:
+                        self._update()
+                    except Exception as e:
+                        # A bad mask must not stop the thread, since it is
+                        # never restarted.
+                        logger.exception(f"Thread error: {e}")
+                    finally:
+                        # A request raised during an error is handled on the
+                        # next pass, so the thread only goes idle without one.
+                        if not self.must_update:
+                            self.idle.set()
+        finally:
+            # Never leave a waiter on the returned event blocked on a thread
+            # that is gone.
+            self.idle.set()
+
+    def _update(self) -> None:
+        """Build and attach the mask, repeating until no new update is requested.
+
+        You must hold "self.lock" while calling this method. It is released
+        while the mask is built, so requests can still be queued.
         """
 
-        try:
-            self.lock.acquire()
-            while self.must_update:
-                self.must_update = False
-
-                # One nice effect of making the mesh first is it will provide
-                # quick user feedback since this operation is much faster than
-                # generating the whole mask.
-                if self.mesh_actor is not None:
-                    self.view_frame.remove_actor(self.mesh_actor)
-                    self.mesh_actor = None
-                    logger.debug("Removed the mesh actor.")
-                if self.show_mesh:
-                    self.mesh_actor = self.mask.make_mesh()
-                    self.view_frame.add_actor(self.mesh_actor)
-                    logger.debug("Added the mesh actor.")
-                    logger.info("Requesting render to show TPS mesh.")
-                    self.view_frame.vtk_render()
-                self.lock.release()
+        while self.must_update:
+            self.must_update = False
 
+            # One nice effect of making the mesh first is it will provide
+            # quick user feedback since this operation is much faster than
+            # generating the whole mask.
+            if self.mesh_actor is not None:
+                self.view_frame.remove_actor(self.mesh_actor)
+                self.mesh_actor = None
+                logger.debug("Removed the mesh actor.")
+            if self.show_mesh:
+                self.mesh_actor = self.mask.make_mesh()
+                self.view_frame.add_actor(self.mesh_actor)
+                logger.debug("Added the mesh actor.")
+                logger.info("Requesting render to show TPS mesh.")
+                self.view_frame.vtk_render()
+
+            self.lock.release()
+            try:
                 logger.debug("Getting the VTK mask...")
                 mask_vtk = self.mask.get_vtk()
                 self.view_frame.v_mapper.SetMaskInput(mask_vtk)
                 logger.debug("Set volume mask input.")
-
+            finally:
                 self.lock.acquire()
 
-            if self.do_render:
-                logger.info("Requesting render.")
-                self.view_frame.vtk_render()
-
-            # We can't release the load lock before this method returns or else
-            # a must_update flag may be raised and never acted upon.
-            self.lock.release()
-        except RuntimeError as e:
-            logger.exception(f"Thread error: {e}")
+        if self.do_render:
+            logger.info("Requesting render.")
+            self.view_frame.vtk_render()
 
     def clear_mask(self) -> None:
         """Remove the mask and mesh actor if needed.
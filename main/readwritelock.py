@@ -0,0 +1,115 @@
+"""A readers-writer lock for data that is read often but rarely replaced."""
+
+#  Open Chrono-Morph Viewer, a project for visualizing volumetric time-series.
+#  Copyright © 2024 Andre C. Faubert
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+from contextlib import contextmanager
+from threading import (
+    Condition,
+    Lock,
+    get_native_id,
+)
+from typing import (
+    Iterator,
+    Optional,
+)
+
+
+class _ReaderShard:
+    """One slice of the reader count with its own mutex."""
+
+    __slots__ = ("cond", "n_readers")
+
+    def __init__(self) -> None:
+        self.cond = Condition(Lock())
+        self.n_readers: int = 0
+
+
+class ReadWriteLock:
+    """Any number of readers may hold the lock at once, but a writer is exclusive.
+
+    The reader count is sharded so that readers on different threads
+    touch different mutexes and do not contend with each other. Each
+    reader only visits the shard belonging to its thread, while a writer
+    visits every shard in order and waits for each one to drain.
+
+    A waiting writer blocks new readers from entering so that a steady
+    stream of readers cannot starve it. The lock is not reentrant: a thread
+    holding the read lock must not try to acquire it again, or it will
+    deadlock against a waiting writer.
+
+    Typical use:
+      with rw_lock.read():
+          ...  # Inspect the shared data.
+      with rw_lock.write():
+          ...  # Replace the shared data.
+    """
+
+    def __init__(self, n_shards: Optional[int] = None) -> None:
+        if n_shards is None:
+            n_shards = os.cpu_count() or 1
+        assert n_shards > 0, "There must be at least one shard."
+        self._shards: list[_ReaderShard] = [_ReaderShard() for _ in range(n_shards)]
+        # Serializes writers with each other.
+        self._writer_lock = Lock()
+        # Set while a writer holds, or is waiting to hold, the lock. Only
+        # ever changed while holding the writer lock.
+        self._writing: bool = False
+
+    def _shard(self) -> _ReaderShard:
+        """The shard belonging to the calling thread."""
+
+        # Native thread IDs are small and sequential on most platforms,
+        # so they spread evenly over the shards.
+        return self._shards[get_native_id() % len(self._shards)]
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """Hold the lock in shared mode for the duration of the context."""
+
+        shard = self._shard()
+        with shard.cond:
+            while self._writing:
+                shard.cond.wait()
+            shard.n_readers += 1
+        try:
+            yield
+        finally:
+            with shard.cond:
+                shard.n_readers -= 1
+                if shard.n_readers == 0:
+                    shard.cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """Hold the lock in exclusive mode for the duration of the context."""
+
+        with self._writer_lock:
+            self._writing = True
+            try:
+                # Readers check the flag under their shard's mutex, so once
+                # each shard has drained, no reader can enter it.
+                for shard in self._shards:
+                    with shard.cond:
+                        while shard.n_readers > 0:
+                            shard.cond.wait()
+                yield
+            finally:
+                self._writing = False
+                for shard in self._shards:
+                    with shard.cond:
+                        shard.cond.notify_all()
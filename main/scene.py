@@ -30,7 +30,7 @@
 import json
 import logging
 import os
-from threading import Thread
+from threading import Event
 from typing import (
     Any,
     Callable,
@@ -490,7 +490,7 @@ you'll have no way to get another!")
             plane.place(self.bounds)
         self.clipping_spline.update_bounds(self.bounds)
 
-    def attach_mask(self, volume: VolumeImage) -> Optional[Thread]:
+    def attach_mask(self, volume: VolumeImage) -> Optional[Event]:
         """Attach a volume mask to the VTK mapper if needed.
 
         This runs on the VolumeUpdater thread, so expensive operations are
@@ -14,9 +14,12 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import heapq
+import itertools
 import logging
 import time
 from threading import (
+    Event,
     Thread,
     Lock,
 )
@@ -34,24 +37,42 @@ from main.errorreporter import (
     FileError,
     ErrorReporter,
 )
+from main.readwritelock import ReadWriteLock
 from main.volumeimage import (
     ImageBounds,
     VolumeImage,
+    bulk_load,
+    read_headers,
 )
 
 logger = logging.getLogger(__name__)
 logger_load = logging.getLogger(__name__ + ".load")
 logger_cache = logging.getLogger(__name__ + ".cache")
 
+# How many volumes the cache daemon picks out to load each time it wakes.
+CACHE_BATCH_SIZE: int = 4
+# How many volumes of a batch the cache daemon reads from disk at the same
+# time. Keeping this below the batch size leaves volumes that can still be
+# skipped when more urgent work arrives.
+CACHE_LOAD_THREADS: int = 2
+# The longest the cache daemon sleeps, in seconds, when nothing wakes it.
+CACHE_IDLE_TIMEOUT: float = 30.
+# How often, in seconds, the cache daemon checks whether the priority
+# threaders have finished their work.
+PRIORITY_POLL_INTERVAL: float = 0.1
+# After this many seeks backward in a row, the cache favors the volumes
+# behind the current one instead of those ahead of it.
+BACKWARD_SEEKS_TO_REVERSE: int = 2
+
 
 class Threader(Protocol):
-    """A threader has a 'thread' attribute which might be None.
+    """A threader has a 'busy' event which is set while it does urgent work.
 
     This is intended for a low-priority daemon that ought to wait for
     other threads to finish before it does its job to avoid resource use.
     """
 
-    thread: Optional[Thread]
+    busy: Event
 
 
 class Timeline:
@@ -87,23 +108,74 @@ class Timeline:
         # This can be dynamically changed to any value, but if you shrink
         # it, it might not respond until you request a volume to be loaded.
         self.memory_target: int = memory_target
-        # Prevents multiple threads from loading volumes into memory
-        # simultaneously. That would result in inaccurate memory usage
-        # reports and potentially more volumes in memory than permitted.
+        # Whether to store 16-bit volumes as 8-bit when none of their values
+        # need more than 8 bits. This never changes a value, but checking
+        # costs a pass over every 16-bit volume, which is wasted on data that
+        # uses the full range, so it is off by default.
+        self.narrow_to_uint8: bool = False
+        # Keeps the memory tally accurate while volumes are loaded and
+        # unloaded, so no more volumes are in memory than permitted. This
+        # lock guards only loading, unloading, and the memory tally. The
+        # cache daemon reserves memory under it and then reads its volumes
+        # without it; see _cache_batch.
         self.load_lock = Lock()
         # While the contents of the timeline are changing, it is impermissible
-        # to access the volumes. This is implemented via a readers-writer lock.
-        # TODO: self.rw_lock = ...
+        # to access the volumes. This is implemented via a readers-writer lock
+        # so that inspecting the volumes from several threads at once never
+        # serializes. When both locks are needed, acquire this one first.
+        self.rw_lock = ReadWriteLock()
         self.index: int = 0
         self.volumes: list[VolumeImage] = []
-        # Bytes of memory used (estimate). Do not edit this estimate without
-        # a load lock in place to ensure it remains accurate.
+        # Bytes of memory used. A volume is counted by its estimate while it
+        # loads and by its loaded size after. Do not edit this tally without
+        # a load lock in place to ensure it remains accurate. Reading it
+        # needs no lock: a plain int is read atomically, and a reader that
+        # only decides whether to do more work can tolerate a stale value.
         self.memory_used: int = 0
+        # The loaded volumes as a min-heap keyed by access time, so the least
+        # recently used volume can be found without sorting. Entries go stale
+        # when a volume is accessed or unloaded elsewhere; they are corrected
+        # as they are popped. The sequence number breaks ties between equal
+        # access times. Only touch these while holding the load lock.
+        self._loaded_heap: list[tuple[float, int, VolumeImage]] = []
+        self._loaded_heap_ids: set[int] = set()
+        self._loaded_heap_seq = itertools.count()
+        # The IDs of the volumes the cache daemon is reading without the load
+        # lock. Their memory is already counted in the tally. Only touch this
+        # while holding the load lock.
+        self._caching_ids: set[int] = set()
         # True when one or more volumes have been added and had their
         # headers read successfully.
         self.available: bool = False
+        # Volume indices ordered from most to least worth caching.
+        self.indices_by_cache_priority: npt.NDArray[np.intp] = np.empty(0, np.intp)
+        # The same order expressed as forward offsets from the current
+        # index. It only depends on the number of volumes, so it is reused
+        # for every seek.
+        self._cache_offset_order: npt.NDArray[np.intp] = np.empty(0, np.intp)
+        # The number of seeks in a row that stepped backward through the
+        # timeline, by the shorter way around. Only the UI thread seeks.
+        self._backward_seeks: int = 0
         self.priority_threaders: list[Threader] = []
         self.cache_thread: Optional[Thread] = None
+        # Set whenever there might be new caching work, to wake the daemon.
+        self._cache_wake = Event()
+        # Summaries of the whole volume list. The volume list is never
+        # modified after it is set, so these are computed once per call to
+        # set_file_paths.
+        self._extreme_bounds_cache: Optional[ImageBounds] = None
+        self._min_scale_cache: Optional[npt.NDArray[np.float64]] = None
+        self._max_voxels_cache: Optional[np.uint64] = None
+        # The group index of each volume, in timeline order.
+        self._group_indices: npt.NDArray[np.int64] = np.empty(0, np.int64)
+        # The time index of each volume, in timeline order.
+        self._time_indices: npt.NDArray[np.int64] = np.empty(0, np.int64)
+        # The lowest volume index of each group, in increasing order.
+        self._group_starts: npt.NDArray[np.intp] = np.empty(0, np.intp)
+        # One past the highest volume index of each group.
+        self._group_ends: npt.NDArray[np.intp] = np.empty(0, np.intp)
+        # The phase of each volume, in timeline order.
+        self._phases: npt.NDArray[np.float64] = np.empty(0, np.float64)
 
     def __len__(self) -> int:
         """The number of volumes this timeline manages."""
@@ -132,69 +204,103 @@ class Timeline:
         assert file_paths, "No file paths were passed."
         logger.debug("set_file_paths")
         file_errors: list[FileError] = []
-        volumes: list[VolumeImage] = list(map(VolumeImage, file_paths))
 
         # All the volumes need to read their corresponding headers to
-        # populate the metadata.
-        volume_error_indices: list[int] = []
-        for i, v in enumerate(volumes):
-            error_msg = v.read_header()
+        # populate the metadata. Reading headers is I/O-bound, so several
+        # are read at once. The progress is reported from this thread.
+        # Each volume is created by the worker that reads its header, and
+        # only the volumes read without error are kept.
+        read_volumes: list[Optional[VolumeImage]] = [None] * len(file_paths)
+        headers = read_headers(file_paths)
+        for n_read, (i, v, error_msg) in enumerate(headers, 1):
             if error_msg is not None:
                 logger.debug(f"Error read volume[{i}] at '{v.path}': {error_msg[0]}")
-                # Note the error and flag the volume for removal.
+                # Note the error; the volume will be left out.
                 file_errors.append(error_msg)
-                volume_error_indices.append(i)
             else:
                 logger.debug(f"Successfully read volume[{i}] at '{v.path}'")
+                read_volumes[i] = v
 
             # Update a status bar if there is one.
-            if progress_callback is not None and progress_callback(i + 1):
+            if progress_callback is not None and progress_callback(n_read):
                 # If the loading operation is canceled, we will still
-                # have at least one volume loaded, so we can continue as
-                # usual.
-                volumes = volumes[:i + 1]
+                # have the volumes read so far, so we can continue as
+                # usual. This cancels the headers not yet being read.
+                headers.close()
                 break
 
-        # Get rid of any erroneous volumes.
-        for i in reversed(volume_error_indices):
-            logger.debug(f"Removing index {i} at {volumes[i].path}")
-            del volumes[i]
+        # Keep only the volumes read without error, in their original order.
+        volumes: list[VolumeImage] = [v for v in read_volumes if v is not None]
 
         # Sort volumes increasing first by group index, the slow time axis.
         volumes.sort(key=lambda vol: (vol.group_index, vol.time_index))
 
-        # Compute the time integral and label the volumes.
-        group_index: Optional[int] = None
-        time_sum: float = 0
-        for i, v in enumerate(volumes):
-            if v.group_index != group_index:
-                group_index = v.group_index
-                # Times are accumulated only for each group.
-                time_sum = 0
-            v.make_label(time_sum, i, len(volumes))
-            time_sum += v.period
+        if len(volumes) > 0:
+            # Mirror the per-volume metadata into arrays, in timeline order.
+            # The volumes remain the source of truth; these are read-only.
+            n = len(volumes)
+            group_indices = np.fromiter((v.group_index for v in volumes), dtype=np.int64, count=n)
+            time_indices = np.fromiter((v.time_index for v in volumes), dtype=np.int64, count=n)
+            phases = np.fromiter((v.phase() for v in volumes), dtype=np.float64, count=n)
+            periods = np.fromiter((v.period for v in volumes), dtype=np.float64, count=n)
+            # The first volume index of each group, and one past the last.
+            group_starts = np.flatnonzero(np.diff(group_indices, prepend=group_indices[0] - 1))
+            group_ends = np.append(group_starts[1:], n)
+
+            # Compute the time integral and label the volumes. Times are
+            # accumulated only for each group.
+            time_sums = np.empty(n, np.float64)
+            for i0, i1 in zip(group_starts, group_ends):
+                time_sums[i0] = 0
+                np.cumsum(periods[i0:i1 - 1], out=time_sums[i0 + 1:i1])
+            for i, v in enumerate(volumes):
+                v.make_label(time_sums[i], i, n)
+
+            # The XYZ geometry of each volume, one row per volume.
+            origins = np.stack([v.origin for v in volumes])
+            scales = np.stack([v.scale for v in volumes])
+            dims = np.stack([v.dims[1:] for v in volumes])
+            extreme_bounds = self._compute_extreme_bounds(origins, scales, dims)
+            min_scale = scales.min(axis=0)
+            # The result is shared by every caller, so protect it from edits.
+            min_scale.flags.writeable = False
+            max_voxels = dims.astype(np.uint64).prod(axis=1).max()
 
         # The daemon threads might be running if this is called a second
         # time with a new list of files, so it needs to be locked.
-        with self.load_lock:
+        with self.rw_lock.write():
             if len(volumes) > 0:
                 # The "open" operation was successful.
-                # Explicitly unload any old volumes so their locks work correctly
-                # to prevent freeing a volume that is in active use by another thread.
-                for v in self.volumes:
-                    v.unload()
+                with self.load_lock:
+                    # Explicitly unload any old volumes so their locks work correctly
+                    # to prevent freeing a volume that is in active use by another thread.
+                    for v in self.volumes:
+                        v.unload()
+                    # This is mostly safe to zero because Python will free the
+                    # unreferenced volume images after the old volume list is
+                    # destroyed, however the rendered volume will stick around for a
+                    # while longer. Luckily, this is only an *estimate* of memory
+                    # usage.
+                    self.memory_used = 0
+                    self._loaded_heap.clear()
+                    self._loaded_heap_ids.clear()
                 self.volumes = volumes
-                # This is mostly safe to zero because Python will free the
-                # unreferenced volume images after the old volume list is
-                # destroyed, however the rendered volume will stick around for a
-                # while longer. Luckily, this is only an *estimate* of memory
-                # usage.
-                self.memory_used = 0
+                self._extreme_bounds_cache = extreme_bounds
+                self._min_scale_cache = min_scale
+                self._max_voxels_cache = max_voxels
+                self._group_indices = group_indices
+                self._time_indices = time_indices
+                self._group_starts = group_starts
+                self._group_ends = group_ends
+                self._phases = phases
                 # Create the index of the "current" volume and ensure the cache
                 # priorities have been established.
-                self.seek(0)
+                self.index = 0
+                self._backward_seeks = 0
+                self._make_cache_priorities()
                 # The timeline can never become unavailable once made available.
                 self.available = True
+                self._cache_wake.set()
                 logger.info("Volumes are now available.")
             else:
                 logger.info("All loaded volumes were erroneous.")
@@ -208,8 +314,21 @@ class Timeline:
 
         assert self.volumes, "You need to call set_file_paths first."
 
-        self.index = index
-        self._make_cache_priorities()
+        # Seeking does not change the volume membership. The new cache
+        # priorities are published with a single assignment, so the shared
+        # lock is sufficient.
+        with self.rw_lock.read():
+            # Follow the direction of travel, so that playing or scrubbing
+            # backward caches the volumes that are about to be shown.
+            step = (index - self.index) % len(self.volumes)
+            if step > len(self.volumes) // 2:
+                self._backward_seeks += 1
+            elif step != 0:
+                self._backward_seeks = 0
+            self.index = index
+            self._make_cache_priorities()
+        # The priorities changed, so the cache may have new work.
+        self._cache_wake.set()
         logger.info(f"Timeline: Sought {index}.")
 
     def get(self,
@@ -227,53 +346,124 @@ class Timeline:
         if index is None:
             index = self.index
         logger.debug(f"Getting volume {index}. Preload? {preload}")
-        if preload:
-            self._load_volume(index)
-        return self.volumes[index]
+        with self.rw_lock.read():
+            if preload:
+                self._load_volume(index)
+            return self.volumes[index]
 
     def _load_volume(self, index: int) -> None:
         """Loads the volume at the index specified into memory.
 
         The memory usage is checked against the target and unloading of
-        less valuable volumes is performed if necessary.
+        less valuable volumes is performed if necessary. The caller must
+        hold the read lock.
         """
 
         assert self, "You need to call set_file_paths first."
 
+        vol: VolumeImage = self.volumes[index]
+        # Volumes that are already cached are the common case. Checking
+        # first saves waiting on the load lock while the cache daemon loads
+        # some other volume. It may be evicted right after, but that was
+        # always possible once the lock was released, and the volume then
+        # reloads itself when its data is requested.
+        if vol.is_loaded():
+            logger_load.info(f"Already loaded {index}.")
+            return
+
         with self.load_lock:
             logger_load.info(f"Trying to load volume {index}.")
-            vol: VolumeImage = self.volumes[index]
             if vol.is_loaded():
                 logger_load.info(f"Already loaded {index}.")
                 return
+            if id(vol) in self._caching_ids:
+                # The cache daemon has already made room for it, so just
+                # load it now rather than waiting on the rest of its batch.
+                # The volume's own lock keeps the two loads apart.
+                logger_load.info(f"Volume {index} is being cached.")
+                # Its memory is settled by the cache daemon.
+                error_message = vol.load(self.narrow_to_uint8)
+                if error_message is None:
+                    self._track_loaded(vol, requested=True)
+                else:
+                    self.error_reporter.file_errors([error_message])
+                return
 
             self.memory_used += vol.estimate_memory()
-            for v in sorted(filter(lambda vo: vo.is_loaded(), self.volumes),
-                            key=lambda vo: vo.access_time):
-                if self.memory_used <= self.memory_target:
-                    break
-                # Find the memory before you unload because the estimate
-                # changes when the mask is unloaded.
-                memory_recovered = v.estimate_memory()
+            # Evict the least recently used volumes until the new one fits.
+            while self.memory_used > self.memory_target and self._loaded_heap:
+                access_time, _, v = self._loaded_heap[0]
+                if v.is_loaded() and v.access_time != access_time:
+                    # Accessed since it was queued; requeue it as it is now
+                    # with a single sift rather than a pop and a push.
+                    heapq.heapreplace(self._loaded_heap,
+                                      (v.access_time, next(self._loaded_heap_seq), v))
+                    continue
+                heapq.heappop(self._loaded_heap)
+                self._loaded_heap_ids.discard(id(v))
+                if not v.is_loaded():
+                    # Already unloaded through unload_volume.
+                    continue
+                if id(v) in self._caching_ids:
+                    # Loaded directly while its batch is still being read.
+                    # The cache daemon tracks it again once its memory is
+                    # settled.
+                    continue
+                memory_recovered = v.loaded_memory()
                 v.unload()
                 self.memory_used -= memory_recovered
                 logger_load.debug(f"Unloaded volume G{v.group_index}T{v.time_index} \
 last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes.")
 
-            error_message = vol.load()
+            error_message = vol.load(self.narrow_to_uint8)
+            # Count it by what it actually takes now that it is loaded.
+            self.memory_used += vol.loaded_memory() - vol.estimate_memory()
+            self._track_loaded(vol, requested=True)
             if error_message is not None:
                 self.error_reporter.file_errors([error_message])
             logger_load.info(f"Loaded {index}.")
 
+    def _track_loaded(self, v: VolumeImage, requested: bool = False) -> None:
+        """Queue a freshly loaded volume for eventual eviction.
+
+        Volumes that have never been displayed keep an access time of zero,
+        so prefetched volumes are always evicted before displayed ones. Among
+        those, the most recently prefetched goes first: the cache daemon loads
+        in order of priority, so it is the one least likely to be needed soon.
+
+        A volume that was requested for display, or that is at the current
+        index, is about to be shown, so it is stamped as accessed now rather
+        than being mistaken for a prefetched one.
+
+        The caller must hold the read lock and the load lock.
+        """
+
+        if requested or v is self.volumes[self.index]:
+            v.access_time = time.time()
+        if id(v) not in self._loaded_heap_ids:
+            self._loaded_heap_ids.add(id(v))
+            seq = next(self._loaded_heap_seq)
+            if v.access_time == 0:
+                seq = -seq
+            heapq.heappush(self._loaded_heap, (v.access_time, seq, v))
+
     def unload_volume(self, index: int) -> None:
         """Unloads the volume at 'index'."""
 
         assert self, "You need to call set_file_paths first."
 
-        v = self.volumes[index]
-        with self.load_lock:
-            v.unload()
-            self.memory_used -= v.estimate_memory()
+        with self.rw_lock.read():
+            v = self.volumes[index]
+            with self.load_lock:
+                # A volume still being cached is left to the cache daemon,
+                # which settles its memory once it is read.
+                if not v.is_loaded() or id(v) in self._caching_ids:
+                    return
+                memory_recovered = v.loaded_memory()
+                v.unload()
+                self.memory_used -= memory_recovered
+        # Memory was freed, so the cache may have room again.
+        self._cache_wake.set()
 
     def get_prev_group_index(self) -> int:
         """The index of the volume with a group index less than the current group
@@ -281,33 +471,26 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
 
         assert self, "You need to call set_file_paths first."
 
-        i = self.index
-        group_index = self.volumes[i].group_index
-        phase = self.volumes[i].phase()
-        while i > 0 and group_index == self.volumes[i].group_index:
-            i -= 1
-        group_index = self.volumes[i].group_index
-        smallest_diff: float = 1.
-        i_best: int = i
-        while i >= 0 and group_index == self.volumes[i].group_index:
-            diff: float = abs(phase - self.volumes[i].phase())
-            if diff > 0.5:
-                diff = 1 - diff
-            if diff <= smallest_diff:
-                smallest_diff = diff
-                i_best = i
-            i -= 1
-        logger.debug(f"Prev. to group index {group_index} from i = {self.index} to {i_best} and phase = "
-                     f"{phase} to best match of {self.volumes[i_best].phase()}")
-        return i_best
+        with self.rw_lock.read():
+            i = self.index
+            i_group = self._group_number(i)
+            phase = self._phases[i]
+            if i_group == 0:
+                # There is no previous group, so go to the start of this one.
+                i_best = 0
+            else:
+                i0 = int(self._group_starts[i_group - 1])
+                i1 = int(self._group_starts[i_group])
+                # The first minimum is kept, so the lower index breaks ties.
+                i_best = int(i0 + self._phase_distances(i0, i1, phase).argmin())
+            logger.debug(f"Prev. to group index {self._group_indices[i_best]} from i = {i} to {i_best} "
+                         f"and phase = {phase} to best match of {self._phases[i_best]}")
+            return i_best
 
     def get_next_group_index(self) -> int:
-        """The index of the volume with a group index less than the current group
-        index and the closest matching phase, if available, otherwise the
-        lowest-indexed volume.
-
-        The index of the first volume with a group index greater than the
-        current group index.
+        """The index of the volume with a group index greater than the current
+        group index and the closest matching phase, if available, otherwise
+        the highest-indexed volume. The higher index breaks ties.
 
         This method is intended to be called when skipping around the timeline
         from one group to the next.
@@ -315,62 +498,81 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
 
         assert self, "You need to call set_file_paths first."
 
-        i = self.index
-        group_index = self.volumes[i].group_index
-        phase = self.volumes[i].phase()
-        i_max = len(self.volumes) - 1
-        while i < i_max and group_index == self.volumes[i].group_index:
-            i += 1
-        group_index = self.volumes[i].group_index
-        smallest_diff: float = 1.
-        i_best: int = i
-        while i <= i_max and group_index == self.volumes[i].group_index:
-            diff: float = abs(phase - self.volumes[i].phase())
-            if diff > 0.5:
-                diff = 1 - diff
-            if diff <= smallest_diff:
-                smallest_diff = diff
-                i_best = i
-            i += 1
-        logger.debug(f"Next to group index {group_index} from i = {self.index} to {i_best} and phase = "
-                     f"{phase} to best match of {self.volumes[i_best].phase()}")
-        return i_best
+        with self.rw_lock.read():
+            i = self.index
+            i_group = self._group_number(i)
+            phase = self._phases[i]
+            if i_group == len(self._group_starts) - 1:
+                # There is no next group, so go to the end of this one.
+                i_best = len(self.volumes) - 1
+            else:
+                i0 = int(self._group_starts[i_group + 1])
+                i1 = int(self._group_ends[i_group + 1])
+                # Search backward so the higher index breaks ties.
+                i_best = int(i1 - 1 - self._phase_distances(i0, i1, phase)[::-1].argmin())
+            logger.debug(f"Next to group index {self._group_indices[i_best]} from i = {i} to {i_best} "
+                         f"and phase = {phase} to best match of {self._phases[i_best]}")
+            return i_best
 
     def get_first_group_index(self) -> int:
         """The lowest index of the volume with a group index equal to the current group."""
 
         assert self, "You need to call set_file_paths first."
 
-        # It's good practice to make a local copy of the current index so
-        # the other threads can't change it in the middle of the operation.
-        i = self.index
-        group_index = self.volumes[i].group_index
-        while i > 0 and group_index == self.volumes[i-1].group_index:
-            i -= 1
-        logger.debug(f"First to group index {group_index} from i = {self.index} to {i}, "
-                     f"G{self.volumes[i].group_index}T{self.volumes[i].time_index}")
-        return i
+        with self.rw_lock.read():
+            # It's good practice to make a local copy of the current index so
+            # the other threads can't change it in the middle of the operation.
+            i = self.index
+            i_first = int(self._group_starts[self._group_number(i)])
+            logger.debug(f"First to group index {self._group_indices[i]} from i = {i} to {i_first}, "
+                         f"G{self._group_indices[i_first]}T{self._time_indices[i_first]}")
+            return i_first
 
     def get_last_group_index(self) -> int:
         """The highest index of the volume with a group index equal to the current group."""
 
         assert self, "You need to call set_file_paths first."
 
-        # It's good practice to make a local copy of the current index so
-        # the other threads can't change it in the middle of the operation.
-        i = self.index
-        group_index = self.volumes[i].group_index
-        while i < len(self.volumes) - 1 and group_index == self.volumes[i+1].group_index:
-            i += 1
-        logger.debug(f"Last to group index {group_index} from i = {self.index} to {i}, "
-                     f"G{self.volumes[i].group_index}T{self.volumes[i].time_index}")
-        return i
+        with self.rw_lock.read():
+            # It's good practice to make a local copy of the current index so
+            # the other threads can't change it in the middle of the operation.
+            i = self.index
+            i_last = int(self._group_ends[self._group_number(i)]) - 1
+            logger.debug(f"Last to group index {self._group_indices[i]} from i = {i} to {i_last}, "
+                         f"G{self._group_indices[i_last]}T{self._time_indices[i_last]}")
+            return i_last
+
+    def _group_number(self, index: int) -> int:
+        """The position of the group containing the volume at 'index'.
+
+        This counts groups from 0 in timeline order; it is not the group
+        index read from the file header. The group starts are sorted, so
+        this is a binary search. The caller must hold the read lock.
+        """
+
+        return int(np.searchsorted(self._group_starts, index, side="right")) - 1
+
+    def _phase_distances(self, i0: int, i1: int, phase: float) -> npt.NDArray[np.float64]:
+        """The cyclic distance from 'phase' to each volume phase in [i0, i1).
+
+        The caller must hold the read lock.
+        """
+
+        diff = np.abs(self._phases[i0:i1] - phase)
+        # Phases wrap around, so a difference of 0.9 is really 0.1.
+        return np.minimum(diff, 1 - diff)
 
     def _make_cache_priorities(self) -> None:
-        """Calculates a sorted list of cache priorities, indicesByCachePriority.
+        """Calculates a sorted array of cache priorities, indices_by_cache_priority.
 
         Cache priorities are assigned based on proximity to the active
-        volume. Subsequent volumes are prioritized over previous volumes.
+        volume. Subsequent volumes are prioritized over previous volumes,
+        unless the recent seeks have been going backward, in which case the
+        order is mirrored.
+
+        The priority of a volume only depends on its offset from the current
+        index, so the sorted order of offsets is computed once and shifted
+        to the current index on each seek, without sorting.
         """
 
         assert self.volumes, "You need to call set_file_paths first."
@@ -378,22 +580,47 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
         # It's good practice to make a local copy of the current index so
         # the other threads can't change it in the middle of the operation.
         index = self.index
+        n = len(self.volumes)
+
+        if len(self._cache_offset_order) != n:
+            self._cache_offset_order = self._make_cache_offset_order(n)
+        if self._backward_seeks >= BACKWARD_SEEKS_TO_REVERSE:
+            indices = index - self._cache_offset_order
+            # The same as modulo n, since both terms are less than n.
+            indices[indices < 0] += n
+        else:
+            indices = self._cache_offset_order + index
+            # The same as modulo n, since both terms are less than n.
+            indices[indices >= n] -= n
+        self.indices_by_cache_priority = indices
+
+    @staticmethod
+    def _make_cache_offset_order(n: int) -> npt.NDArray[np.intp]:
+        """Sort the offsets from the current volume by cache priority.
+
+        :param n: The number of volumes in the timeline.
+        :return: Forward offsets, modulo n, from most to least worth caching.
+        """
 
-        relative_index = np.arange(len(self.volumes)) - index
-        # By the magic of modulo, these always represent the positive
-        # distance in front or behind while accounting for wrap-around.
-        forward_distances = relative_index % len(self.volumes)
-        backward_distances = (-relative_index) % len(self.volumes)
+        # The positive distance in front or behind while accounting for
+        # wrap-around, plus 1. The addition of 1 smooths the metric a little
+        # and prevents division by 0. Everything is computed in place in two
+        # buffers to avoid temporaries.
+        forward_terms = np.arange(1, n + 1, dtype=np.float64)
+        cache_priorities = np.arange(n + 1, 1, -1, dtype=np.float64)
+        # The backward distance of the current volume wraps around to 0.
+        cache_priorities[0] = 1
 
         # The multiplier on the forward distance is called the "forward
         # bias". It is approximately the number of forward-looking volumes
         # that go ahead of each backward-looking volume in the queue.
-        # The addition of 1 smooths the metric a little and prevents division by 0.
-        cache_priorities = 4 / (1 + forward_distances) + 1 / (1 + backward_distances)
+        # Priority = 4 / (1 + forward) + 1 / (1 + backward)
+        np.divide(4, forward_terms, out=forward_terms)
+        np.reciprocal(cache_priorities, out=cache_priorities)
+        cache_priorities += forward_terms
 
-        self.indices_by_cache_priority = list(range(len(self.volumes)))
-        self.indices_by_cache_priority.sort(key=lambda i: cache_priorities[i],
-                                            reverse=True)
+        # A stable sort puts the nearer forward offset first when priorities tie.
+        return np.argsort(-cache_priorities, kind="stable")
 
     def get_label(self) -> str:
         """The label attached to the current volume.
@@ -403,13 +630,14 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
         """
 
         assert self, "You need to call set_file_paths first."
-        return self.volumes[self.index].label
+        with self.rw_lock.read():
+            return self.volumes[self.index].label
 
     def set_priority_threaders(self, priority_threaders: list[Threader]) -> None:
-        """Assign a list of objects containing a 'thread' attribute.
+        """Assign a list of objects containing a 'busy' event.
 
-        The cache daemon will not run while the thread contained in each
-        suspender runs. As such, these threads are 'high priority'.
+        The cache daemon will not load volumes while the event of any
+        threader is set. As such, these threads are 'high priority'.
         """
 
         self.priority_threaders = priority_threaders
@@ -442,11 +670,9 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
                 # This is not race-condition-proof, but a race-condition
                 # here is unlikely to happen, and the worst-case result is a
                 # momentary lag in the volume loader.
-                for pt in self.priority_threaders:
-                    t = pt.thread
-                    if t and t.is_alive():
-                        t.join()
-                        continue
+                if self._priority_threaders_busy():
+                    self._cache_daemon_sleep(PRIORITY_POLL_INTERVAL)
+                    continue
 
                 if not self:
                     # No volumes have been added, so there is nothing to do yet.
@@ -454,35 +680,118 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
                     self._cache_daemon_sleep()
                     continue
 
-                if self.memory_used >= self.memory_target:
+                # Read the tally once without the load lock. At worst, a
+                # racing load or unload costs one extra or missed wakeup.
+                memory_used = self.memory_used
+                if memory_used >= self.memory_target:
                     # The memory is full. Check again later.
-                    logger_cache.info(f"Memory full: {self.memory_used:0.2g}/{self.memory_target:0.2g}.")
+                    logger_cache.info(f"Memory full: {memory_used:0.2g}/{self.memory_target:0.2g}.")
                     self._cache_daemon_sleep()
                     continue
 
-                for i in self.indices_by_cache_priority:
-                    v: VolumeImage = self.volumes[i]
-                    if not v.is_loaded():
-                        logger_cache.info(f"Caching volume {i}, memory is at \
-{self.memory_used:0.2g}/{self.memory_target:0.2g}..")
-                        with self.load_lock:
-                            v.load()
-                            self.memory_used += v.estimate_memory()
-                        logger_cache.info(f"Caching volume {i} done. Added \
-{v.estimate_memory():0.2g} memory.")
-                        break
-                else:
+                with self.rw_lock.read():
+                    volumes = self.volumes
+                    batch = self._next_uncached_indices(CACHE_BATCH_SIZE)
+                if not batch:
                     # No volume worth loading. Check again later.
                     logger_cache.info("No volume worth loading.")
                     self._cache_daemon_sleep()
+                    continue
+
+                self._cache_batch(volumes, batch)
         except RuntimeError as e:
             logger_cache.exception(f"Thread error: {e}")
 
-    @staticmethod
-    def _cache_daemon_sleep() -> None:
-        """Sleep for the standard idle time."""
+    def _cache_batch(self, volumes: list[VolumeImage], batch: list[int]) -> None:
+        """Load a batch of volumes chosen by the cache daemon all at once.
+
+        The volumes are read a few at a time through bulk_load. Only as
+        many volumes as fit in memory are loaded, and once a priority
+        threader becomes busy, the volumes not yet started are skipped.
+        'volumes' is the list the batch was chosen from.
+
+        Their memory is reserved up front, and then they are read without
+        holding the read lock or the load lock. That way, seeking to another
+        volume, unloading, or replacing the volumes never waits on the whole
+        batch. Each volume's own lock keeps its loading and unloading apart.
+        """
+
+        # Back off as soon as there is more urgent work.
+        if self._priority_threaders_busy():
+            return
+
+        with self.rw_lock.read():
+            if self.volumes is not volumes:
+                # The batch is stale.
+                return
+            with self.load_lock:
+                memory_used = self.memory_used
+                to_load: list[VolumeImage] = []
+                for i in batch:
+                    v: VolumeImage = volumes[i]
+                    # Another thread may have loaded it since the batch was
+                    # chosen.
+                    if v.is_loaded() or id(v) in self._caching_ids:
+                        continue
+                    if memory_used >= self.memory_target:
+                        break
+                    memory_used += v.estimate_memory()
+                    to_load.append(v)
+                if not to_load:
+                    return
+                logger_cache.info(f"Caching {len(to_load)} volumes, memory is \
+at {self.memory_used:0.2g}/{self.memory_target:0.2g}..")
+                self.memory_used = memory_used
+                self._caching_ids.update(id(v) for v in to_load)
+
+        errors = bulk_load(to_load,
+                           max_workers=CACHE_LOAD_THREADS,
+                           narrow_to_uint8=self.narrow_to_uint8,
+                           stop=self._priority_threaders_busy)
+
+        with self.rw_lock.read():
+            with self.load_lock:
+                self._caching_ids.difference_update(id(v) for v in to_load)
+                if self.volumes is not volumes:
+                    # The volumes were replaced while they were read, and
+                    # the memory tally was reset along with them.
+                    return
+                for v in to_load:
+                    # Trade the reservation for what it actually takes. One
+                    # that failed to load or was skipped takes nothing.
+                    self.memory_used += v.loaded_memory() - v.estimate_memory()
+                    if v.is_loaded():
+                        self._track_loaded(v)
+                memory_used = self.memory_used
+        logger_cache.info(f"Caching {len(to_load)} volumes done with \
+{len(errors)} errors. Memory is at {memory_used:0.2g}/{self.memory_target:0.2g}.")
+
+    def _next_uncached_indices(self, n: int) -> list[int]:
+        """The indices of up to 'n' of the most urgent volumes that aren't loaded.
+
+        The caller must hold the read lock.
+        """
+
+        indices: list[int] = []
+        for i in self.indices_by_cache_priority:
+            if not self.volumes[i].is_loaded():
+                indices.append(int(i))
+                if len(indices) >= n:
+                    break
+        return indices
+
+    def _priority_threaders_busy(self) -> bool:
+        """Whether any of the priority threaders is doing urgent work."""
 
-        time.sleep(5)
+        return any(pt.busy.is_set() for pt in self.priority_threaders)
+
+    def _cache_daemon_sleep(self, timeout: float = CACHE_IDLE_TIMEOUT) -> None:
+        """Sleep until there might be work to do, or the timeout passes."""
+
+        self._cache_wake.wait(timeout=timeout)
+        # The daemon rechecks everything after waking, so any signal sent
+        # before this point has already been accounted for.
+        self._cache_wake.clear()
 
     def check_memory(self) -> Tuple[int, int]:
         """Check the memory to verify that the memory tally is correct.
@@ -495,11 +804,12 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
 
         n_loaded: int = 0
         actual_memory_used: int = 0
-        for i, v in enumerate(self.volumes):
-            if v.is_loaded():
-                logger.info(f"Check memory: volumes[{i}] is loaded.")
-                n_loaded += 1
-                actual_memory_used += v.estimate_memory()
+        with self.rw_lock.read():
+            for i, v in enumerate(self.volumes):
+                if v.is_loaded():
+                    logger.info(f"Check memory: volumes[{i}] is loaded.")
+                    n_loaded += 1
+                    actual_memory_used += v.loaded_memory()
         logger.info(f"Check memory: {n_loaded} volumes are loaded taking \
 {actual_memory_used:0.2g} as compared to {self.memory_used:0.2g} tallied.")
         return n_loaded, actual_memory_used
@@ -508,34 +818,39 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
         """Find the bounds that encompass all volumes in the timeline."""
 
         assert self, "You need to call set_file_paths first."
-
-        with self.load_lock:
-            # Rearrange bounds.
-            bounds = list(zip(*(v.bounds() for v in self.volumes)))
-            return ImageBounds(
-                min(bounds[0]), max(bounds[1]),
-                min(bounds[2]), max(bounds[3]),
-                min(bounds[4]), max(bounds[5])
-            )
+        assert self._extreme_bounds_cache is not None
+        return self._extreme_bounds_cache
 
     def min_scale(self) -> npt.NDArray[np.float64]:
         """Find the smallest scale for each axis across all volumes."""
 
         assert self, "You need to call set_file_paths first."
-
-        with self.load_lock:
-            all_scales = np.array([v.scale for v in self.volumes])
-            return np.min(all_scales, axis=0)
+        assert self._min_scale_cache is not None
+        return self._min_scale_cache
 
     def max_voxels(self) -> np.uint64:
         """Find the largest number of voxels across all volumes."""
 
         assert self, "You need to call set_file_paths first."
+        assert self._max_voxels_cache is not None
+        return self._max_voxels_cache
 
-        with self.load_lock:
-            all_dims = np.array([v.dims[1:] for v in self.volumes],
-                                dtype=np.uint64)
-            return all_dims.prod(axis=1).max()
+    @staticmethod
+    def _compute_extreme_bounds(origins: npt.NDArray[np.float64],
+                                scales: npt.NDArray[np.float64],
+                                dims: npt.NDArray[np.int_]) -> ImageBounds:
+        """Find the bounds that encompass all the volumes given.
+
+        Each argument has one XYZ row per volume, as in VolumeImage.bounds.
+        """
+
+        lower = origins.min(axis=0)
+        upper = (origins + scales * dims).max(axis=0)
+        return ImageBounds(
+            lower[0], upper[0],
+            lower[1], upper[1],
+            lower[2], upper[2]
+        )
 
     def get_view_scale(self) -> float:
         """Determines the window scale that will fit the current volume.
@@ -544,7 +859,8 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
         """
 
         assert self, "You need to call set_file_paths first."
-        return self.volumes[self.index].view_scale()
+        with self.rw_lock.read():
+            return self.volumes[self.index].view_scale()
 
     def get_group_lengths(self) -> list[int]:
         """Count the number of volumes for each group in the timeline.
@@ -553,19 +869,11 @@ last accessed at {v.access_time:.3f} and recovered {memory_recovered:0.2g} bytes
             Example: [70, 70, 73, 66, ...]
         """
 
-        group_lengths: list[int] = []
-        with self.load_lock:
-            if not self:
-                return group_lengths
-
-            last_group_index = self.volumes[0].group_index
-            last_len: int = 1
-            for v in self.volumes[1:]:
-                if last_group_index != v.group_index:
-                    group_lengths.append(last_len)
-                    last_group_index = v.group_index
-                    last_len = 0
-                last_len += 1
-        if last_len > 0:
-            group_lengths.append(last_len)
-        return group_lengths
+        # Take a local copy in case the volumes are replaced meanwhile.
+        group_indices = self._group_indices
+        if len(group_indices) == 0:
+            return []
+        # The volumes are sorted by group, so each group is one contiguous
+        # run and the lengths are the distances between run boundaries.
+        boundaries = np.flatnonzero(np.diff(group_indices)) + 1
+        return np.diff(boundaries, prepend=0, append=len(group_indices)).tolist()
@@ -41,8 +41,11 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+from functools import lru_cache
 from typing import Any, Optional
 
+import numpy as np
+
 from main.autoplayer import AutoPlayer
 from main.eventfilter import EditDoneEventFilter
 from main.timeline import Timeline
@@ -55,6 +58,10 @@ from ui.main_window import Ui_MainWindow
 
 logger = logging.getLogger(__name__)
 
+# The slider gradient color for each stop, repeating every four stops so that
+# each pair of stops bounding a group shares a color.
+_STOP_COLORS: tuple[str, ...] = ("eee", "eee", "ccc", "ccc")
+
 
 class TimelineSlider:
     """Manages the UI related to the timeline slider and associated buttons."""
@@ -71,71 +78,67 @@ class TimelineSlider:
         self.edit_cycles_filter: Optional[EditDoneEventFilter] = None
         self.n_cycles: int = 1
         self.cycles_remaining: int = self.n_cycles
+        # The timeline only changes size right before a reset, so its length
+        # is tracked here rather than asking the timeline on every event.
+        self._timeline_len: int = 0
+        # The text last shown in the timepoint label.
+        self._label_text: Optional[str] = None
+        # The group lengths behind the current slider style sheet and loop
+        # tables.
+        self._group_lengths: Optional[tuple[int, ...]] = None
+        # The index one step forward or back from each index when looping
+        # forever within the current group.
+        self._next_index: list[int] = []
+        self._prev_index: list[int] = []
+        # The first and last index of the current group, when known.
+        self._group_bounds: Optional[tuple[int, int]] = None
         self.reset()
 
     def reset(self) -> None:
         """Return everything to its default state."""
 
+        self._timeline_len = len(self.timeline)
+        self._group_bounds = None
         self.cycles_remaining = self.n_cycles
         self.auto_player.set_playing(False)
         self.ui.button_play.setChecked(False)
         self.ui.edit_goto_time.setText("1")
-        self.ui.slider_timeline.setMinimum(0)
-        # The timeline might be empty when this is first called.
-        self.ui.slider_timeline.setMaximum(max(0, len(self.timeline) - 1))
-        self.ui.slider_timeline.setSingleStep(1)
-        self.ui.slider_timeline.setValue(0)
-        self.ui.slider_timeline.setStyleSheet(self._get_style_sheet())
+        # Apply all the slider changes at once with one repaint. Signals are
+        # blocked so moving the slider back to 0 doesn't call set_index; the
+        # timeline starts at index 0 whenever it is reset anyway.
+        slider = self.ui.slider_timeline
+        slider.blockSignals(True)
+        slider.setUpdatesEnabled(False)
+        try:
+            slider.setMinimum(0)
+            # The timeline might be empty when this is first called.
+            slider.setMaximum(max(0, self._timeline_len - 1))
+            slider.setSingleStep(1)
+            slider.setValue(0)
+            # Setting a style sheet makes Qt re-polish the slider, so only do
+            # it when the groups have actually changed.
+            group_lengths = tuple(self.timeline.get_group_lengths())
+            if group_lengths != self._group_lengths:
+                self._group_lengths = group_lengths
+                slider.setStyleSheet(_build_style_sheet(group_lengths))
+                self._next_index, self._prev_index = _make_loop_tables(group_lengths)
+        finally:
+            slider.setUpdatesEnabled(True)
+            slider.blockSignals(False)
+        slider.update()
         self._update_fps_field()
         self._update_cycles_field()
         self._update_label()
 
-    def _get_style_sheet(self) -> str:
-        """Make the slider style sheet to highlight different groups in alternating tones.
-
-        An alternating style sheet is only produced when there are at least two
-        volumes in the timeline which share a group. Otherwise, the empty style
-        sheet is returned.
-
-        "Singletons", i.e., volumes which are the only examples of their group
-        index, are consolidated with their neighbors to form blocks. This
-        prevents lots of alternating colors when unrelated volumes are loaded.
-        """
-
-        s_lens = self.timeline.get_group_lengths()
-        s_lens = _consolidate_ones(s_lens)
-        if len(s_lens) < 2:
-            return ""  # The default style sheet.
-
-        n = sum(s_lens)
-
-        # This is the gap on the left and right of the slider. This value is a
-        # hack that works well enough for typical window sizes.
-        edge_width = 0.005
-        gap_width = (1 - 2 * edge_width) / (n - 1)
-
-        # Normalized gradient stop indices range from [0-1].
-        stops: list[float] = [0.]
-        stop: float = edge_width - gap_width/2
-        epsilon = 1e-5  # The width of the transitions is small but non-zero.
-        for sl in s_lens[:-1]:
-            stop += sl * gap_width
-            stops.append(stop)
-            stops.append(stop + epsilon)
-        stops.append(1.)
-
-        style_sheet = ["QSlider {background: qlineargradient(x1: 0, x2: 1"]
-        for i, s in enumerate(stops):
-            # Light and dark grey alternate (color code #eee = 0xe0e0e0, etc.).
-            color = "eee" if i // 2 % 2 == 0 else "ccc"
-            style_sheet.append(f", stop:{s:.6g} #{color}")
-        style_sheet.append(");}")
-        return "".join(style_sheet)
-
     def _update_fps_field(self) -> None:
         """Set the volume playback rate in the UI."""
 
-        self.ui.edit_fps.setText(f"{self.auto_player.fps:0.2f}")
+        # The user may have typed over the field, so compare against what it
+        # shows now rather than what was last set. Setting identical text
+        # would still make Qt lay it out again.
+        text = f"{self.auto_player.fps:0.2f}"
+        if self.ui.edit_fps.text() != text:
+            self.ui.edit_fps.setText(text)
 
     def _read_fps_field(self) -> None:
         """Interpret and validate the volume playback rate in the UI."""
@@ -147,7 +150,9 @@ class TimelineSlider:
     def _update_cycles_field(self) -> None:
         """Set the number of cycles to repeat in the UI."""
 
-        self.ui.edit_n_cycles.setText(str(self.n_cycles))
+        text = str(self.n_cycles)
+        if self.ui.edit_n_cycles.text() != text:
+            self.ui.edit_n_cycles.setText(text)
 
     def _read_cycles_field(self) -> None:
         """Interpret and validate the number of cycles to repeat in the UI."""
@@ -165,9 +170,11 @@ class TimelineSlider:
         from which to get the label.
         """
 
-        self.ui.label_timepoint.setText(
-            self.timeline.get_label() if self.timeline else ""
-        )
+        text = self.timeline.get_label() if self._timeline_len else ""
+        # The label is not editable, so the last text set is what it shows.
+        if text != self._label_text:
+            self._label_text = text
+            self.ui.label_timepoint.setText(text)
 
     def bind_event_listeners(self) -> None:
         """Set UI input functions for the timeline slider and controls."""
@@ -206,41 +213,64 @@ class TimelineSlider:
         self.ui.action_end_of_group.triggered.connect(self._goto_group_end)
         self.ui.action_end_of_group.setShortcut(".")
 
-    def set_index(self, index: int) -> None:
+    def set_index(self, index: int, settle: bool = True) -> None:
         """Update the slider position (0-based indexing).
 
         Ensures that the timeline and volume view stay up to date, too. It
         is safe to call this function even when there is nothing in the
         timeline.
+
+        :param index: The timeline index to show.
+        :param settle: Passed on to VolumeUpdater.queue.
         """
 
-        if not self.timeline:
+        if self._timeline_len == 0:
+            return
+        # Compare with the timeline rather than the slider, since the slider
+        # has already moved by the time it signals a new value.
+        if index == self.timeline.index:
             return
 
         logger.info(f"Set_index({index}).")
+        # Groups are contiguous, so the bounds only change when the index
+        # leaves them.
+        bounds = self._group_bounds
+        if bounds is not None and not bounds[0] <= index <= bounds[1]:
+            self._group_bounds = None
         # Can't call self.ui.slider_timeline.setValue(index) or it will
         # trigger an event that will call this function again.
         self.ui.slider_timeline.setSliderPosition(index)
         self.timeline.seek(index)
         self._update_label()
-        self.volume_updater.queue()
+        self.volume_updater.queue(settle)
 
-    def add(self, delta: int) -> None:
+    def add(self, delta: int, settle: bool = True) -> None:
         """Add delta to the slider index with wrap-around.
 
         It is safe to call this function even when there is nothing in the
         timeline.
+
+        :param delta: How many steps to move the slider.
+        :param settle: Passed on to VolumeUpdater.queue.
         """
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
-        slider_n = 1 + self.ui.slider_timeline.maximum()
-        p = self.ui.slider_timeline.sliderPosition()
+        slider = self.ui.slider_timeline
+        p = slider.sliderPosition()
+
+        # When looping forever, a single step never leaves the group, so the
+        # result only depends on the position.
+        if self.n_cycles == 0 and (delta == 1 or delta == -1):
+            self.set_index(self._next_index[p] if delta == 1 else self._prev_index[p],
+                           settle=settle)
+            return
+
+        slider_n = 1 + slider.maximum()
         p_next = (p + delta) % slider_n
 
-        i0: int = self.timeline.get_first_group_index()
-        i1: int = self.timeline.get_last_group_index()
+        i0, i1 = self._get_group_bounds()
         logger.debug(
             f"Add {delta} to {p}. Bounds: {i0} to {i1}. Cycles: {self.cycles_remaining}/{self.n_cycles}")
 
@@ -249,35 +279,48 @@ class TimelineSlider:
         crossing: bool = crossing_left_bound or crossing_right_bound
 
         if crossing and i0 != i1:
-            if self.cycles_remaining == 1:
+            cycles_remaining = self.cycles_remaining
+            if cycles_remaining == 1:
                 self.cycles_remaining = self.n_cycles
                 # Continue as usual.
             else:
-                self.cycles_remaining -= 1
+                self.cycles_remaining = cycles_remaining - 1
                 p_next = i1 if crossing_left_bound else i0
 
         # We only bother to define cycle wrapping for the case of a single step forward or backward.
         # If cycles_remaining == 0, this will never stop. This is a feature, not a bug.
 
         logger.debug(f"Result: {p_next}. Cycles: {self.cycles_remaining}/{self.n_cycles}")
-        self.set_index(p_next)
+        self.set_index(p_next, settle=settle)
+
+    def _get_group_bounds(self) -> tuple[int, int]:
+        """The first and last index of the current group in the timeline."""
+
+        bounds = self._group_bounds
+        if bounds is None:
+            timeline = self.timeline
+            bounds = (timeline.get_first_group_index(),
+                      timeline.get_last_group_index())
+            self._group_bounds = bounds
+        return bounds
 
     def _on_goto(self, _: Any = None) -> None:
         """Respond to the "go to" button event."""
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
         # UI indices start at 1, not 0.
-        index = validate_int(self.ui.edit_goto_time.text(), 1, len(self.timeline))
-        self.ui.edit_goto_time.setText(str(index))
+        edit = self.ui.edit_goto_time
+        index = validate_int(edit.text(), 1, self._timeline_len)
+        edit.setText(str(index))
         self.set_index(index - 1)
         self.cycles_remaining = self.n_cycles
 
     def _on_prev_group(self, _: Any = None) -> None:
         """Respond to the "previous group" button event."""
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
         self.set_index(self.timeline.get_prev_group_index())
@@ -286,7 +329,7 @@ class TimelineSlider:
     def _on_next_group(self, _: Any = None) -> None:
         """Respond to the "next group" button event."""
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
         self.set_index(self.timeline.get_next_group_index())
@@ -295,22 +338,95 @@ class TimelineSlider:
     def _goto_group_start(self, _: Any = None) -> None:
         """Respond to a key event, jumping to the beginning of the current group."""
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
-        self.set_index(self.timeline.get_first_group_index())
+        self.set_index(self._get_group_bounds()[0])
         self.cycles_remaining = self.n_cycles
 
     def _goto_group_end(self, _: Any = None) -> None:
         """Respond to a key event, jumping to the end of the current group."""
 
-        if not self.timeline:
+        if self._timeline_len == 0:
             return
 
-        self.set_index(self.timeline.get_last_group_index())
+        self.set_index(self._get_group_bounds()[1])
         self.cycles_remaining = self.n_cycles
 
 
+@lru_cache(maxsize=32)
+def _build_style_sheet(group_lengths: tuple[int, ...]) -> str:
+    """Make the slider style sheet to highlight different groups in alternating tones.
+
+    An alternating style sheet is only produced when there are at least two
+    volumes in the timeline which share a group. Otherwise, the empty style
+    sheet is returned.
+
+    "Singletons", i.e., volumes which are the only examples of their group
+    index, are consolidated with their neighbors to form blocks. This
+    prevents lots of alternating colors when unrelated volumes are loaded.
+
+    The result only depends on the group lengths, so it is cached for when
+    the same timeline is reset repeatedly.
+    """
+
+    s_lens = _consolidate_ones(list(group_lengths))
+    if len(s_lens) < 2:
+        return ""  # The default style sheet.
+
+    n = sum(s_lens)
+
+    # This is the gap on the left and right of the slider. This value is a
+    # hack that works well enough for typical window sizes.
+    edge_width = 0.005
+    gap_width = (1 - 2 * edge_width) / (n - 1)
+
+    # Normalized gradient stop indices range from [0-1]. Each group
+    # boundary has a pair of stops to make a sharp transition.
+    epsilon = 1e-5  # The width of the transitions is small but non-zero.
+    # Accumulate from the first offset so the sums round the same way
+    # as stepping along the slider one group at a time.
+    steps = np.empty(len(s_lens))
+    steps[0] = edge_width - gap_width/2
+    np.multiply(s_lens[:-1], gap_width, out=steps[1:])
+    boundaries = np.cumsum(steps)[1:]
+    stops = np.empty(2 * len(boundaries) + 2)
+    stops[0] = 0.
+    stops[1:-1:2] = boundaries
+    stops[2:-1:2] = boundaries + epsilon
+    stops[-1] = 1.
+
+    # Light and dark grey alternate (color code #eee = 0xe0e0e0, etc.).
+    gradient = "".join(
+        f", stop:{s:.6g} #{_STOP_COLORS[i & 3]}"
+        for i, s in enumerate(stops.tolist())
+    )
+    return f"QSlider {{background: qlineargradient(x1: 0, x2: 1{gradient});}}"
+
+
+def _make_loop_tables(group_lengths: tuple[int, ...]) -> tuple[list[int], list[int]]:
+    """Tabulate single steps forward and back that wrap around within each group.
+
+    Stepping off either end of a group returns to its other end. Groups with
+    one volume can't loop, so stepping from them moves on to the neighboring
+    volume, wrapping around the whole timeline.
+
+    :return: The next and previous index for each index in the timeline.
+    """
+
+    lens = np.asarray(group_lengths, dtype=np.intp)
+    n = int(lens.sum())
+    ends = np.cumsum(lens)
+    starts = ends - lens
+    looping = lens > 1
+
+    next_index = np.arange(1, n + 1)
+    next_index[ends - 1] = np.where(looping, starts, ends % n)
+    prev_index = np.arange(-1, n - 1)
+    prev_index[starts] = np.where(looping, ends - 1, (starts - 1) % n)
+    return next_index.tolist(), prev_index.tolist()
+
+
 def _consolidate_ones(arr: list[int]) -> list[int]:
     """Consolidate any adjacent 1's into their sums.
 
@@ -319,19 +435,14 @@ def _consolidate_ones(arr: list[int]) -> list[int]:
         -> [70, 70, 1, 73, 3, 75, 2]
     """
 
-    result: list[int] = []
-    ones_sum: int = 0
-
-    for num in arr:
-        if num == 1:
-            ones_sum += 1
-        else:
-            if ones_sum > 0:
-                result.append(ones_sum)
-                ones_sum = 0
-            result.append(num)
-
-    if ones_sum > 0:
-        result.append(ones_sum)
-
-    return result
+    if len(arr) == 0:
+        return []
+    a = np.asarray(arr)
+    is_one = a == 1
+    # Every entry other than a 1 starts its own segment, as does the first 1
+    # of each run. Summing each segment up to the start of the next one then
+    # leaves the other entries alone and collapses each run into its length.
+    starts = ~is_one
+    starts[0] = True
+    starts[1:] |= ~is_one[:-1]
+    return np.add.reduceat(a, np.flatnonzero(starts)).tolist()
@@ -17,23 +17,35 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import math
+import re
 from typing import Optional
 
+# Screen out malformed input before converting it, since raising and catching
+# a ValueError on every bad keystroke is comparatively slow. These accept the
+# same decimal forms as int() and float(), minus digit-group underscores.
+_INT_RE: re.Pattern[str] = re.compile(r"\s*[+-]?\d+\s*")
+_FLOAT_RE: re.Pattern[str] = re.compile(
+    r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*")
+# Matches the exponent of a formatted float, capturing its sign only when
+# negative and its digits after any leading zeros.
+_EXP_RE: re.Pattern[str] = re.compile(r"e\+?(-?)0*(\d)")
+
 
 def validate_int(value: str, min_: int, max_: Optional[int] = None,
                  default: Optional[int] = None) -> int:
     """Force value to be an int within min_ and max_."""
 
-    try:
+    if _INT_RE.fullmatch(value):
         ret = int(value)
-    except ValueError:
-        if default is None:
-            ret = min_
-        else:
-            ret = default
-    ret = max(min_, ret)
-    if max_ is not None:
-        ret = min(max_, ret)
+    elif default is None:
+        ret = min_
+    else:
+        ret = default
+    # The lower bound is applied first, so max_ wins if the bounds cross.
+    if ret < min_:
+        ret = min_
+    if max_ is not None and ret > max_:
+        ret = max_
     return ret
 
 
@@ -43,24 +55,26 @@ def validate_float(value: str, min_: float, max_: float) -> float:
     Defaults to _min when a non-real value is passed, such as "NaN" or "-inf".
     """
 
-    try:
-        ret = float(value)
-    except ValueError:
-        ret = min_
-    if math.isnan(ret) or math.isinf(ret):
+    # Non-finite spellings like "nan" and "inf" fail the match, but a huge
+    # exponent can still overflow to infinity.
+    if not _FLOAT_RE.fullmatch(value):
         return min_
-    ret = max(min_, min(max_, ret))
-    return ret
+    ret = float(value)
+    if math.isinf(ret):
+        return min_
+    # The upper bound is applied first, so min_ wins if the bounds cross.
+    if ret > max_:
+        ret = max_
+    return min_ if ret < min_ else ret
 
 
 def validate_float_any(value: str, default: float = 0) -> float:
     """Force value to be any real float, with a default upon failure."""
 
-    try:
-        ret = float(value)
-    except ValueError:
+    if not _FLOAT_RE.fullmatch(value):
         return default
-    if math.isnan(ret) or math.isinf(ret):
+    ret = float(value)
+    if math.isinf(ret):
         return default
     return ret
 
@@ -71,7 +85,4 @@ def nice_exp_format(x: str) -> str:
     Example: nice_format('5.234e+09') -> '5.234e9'
     """
 
-    x = x.replace("e+0", "e")
-    x = x.replace("e+", "e")
-    x = x.replace("e-0", "e-")
-    return x
+    return _EXP_RE.sub(r"e\1\2", x)
@@ -28,6 +28,7 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+from threading import Lock
 from typing import Optional
 
 from PyQt5.QtCore import (
@@ -78,6 +79,11 @@ class ViewFrame(QFrame):
         # while switching active volumes.
         self._current_volume_image: Optional[VolumeImage] = None
 
+        # Set while a render has been requested but has not yet started, so
+        # back-to-back requests from the worker threads share one render.
+        self._render_pending: bool = False
+        self._render_lock = Lock()
+
         # Initialize stuff here.
         self._setup_misc_vtk()
         self._setup_interactor()
@@ -209,9 +215,15 @@ class ViewFrame(QFrame):
     def vtk_render(self) -> None:
         """Request a render from the UI thread.
 
-        This method can be safely called from any thread.
+        This method can be safely called from any thread. Requests made
+        before a pending render starts are merged into it.
         """
 
+        with self._render_lock:
+            if self._render_pending:
+                logger.debug("Render already pending.")
+                return
+            self._render_pending = True
         # noinspection PyUnresolvedReferences
         self._render_signal.emit()
 
@@ -225,6 +237,10 @@ class ViewFrame(QFrame):
         volume mapper hasn't been set up.
         """
 
+        # Clear the flag first so that a request made during the render
+        # schedules another one.
+        with self._render_lock:
+            self._render_pending = False
         if self.renderer.GetVolumes().GetNumberOfItems() > 0:
             self.interactor.GetRenderWindow().Render()
             logger.info("VTK rendered.")
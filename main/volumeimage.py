@@ -27,12 +27,24 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bz2
+import gzip
 import logging
 import math
+import mmap
+import os
 import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
 from threading import Lock
 from typing import (
     Any,
+    BinaryIO,
+    Callable,
+    Iterable,
+    Iterator,
     NamedTuple,
     Optional,
 )
@@ -40,12 +52,58 @@ from typing import (
 import nrrd  # type: ignore
 import numpy as np
 import numpy.typing as npt
+from vtkmodules.vtkCommonCore import (
+    VTK_SHORT,
+    VTK_UNSIGNED_CHAR,
+    VTK_UNSIGNED_SHORT,
+)
 from vtkmodules.vtkIOImage import vtkImageImport
 
 from main.errorreporter import FileError
 
 logger = logging.getLogger(__name__)
 
+# Raw image data is read from disk in pieces of this many bytes.
+READ_CHUNK_SIZE: int = 1 << 24
+# Opens a decompressing stream over the data for each compressed encoding.
+_DECOMPRESSORS: dict[str, Callable[[BinaryIO], BinaryIO]] = {
+    "gzip": lambda fh: gzip.GzipFile(fileobj=fh, mode="rb"),
+    "gz": lambda fh: gzip.GzipFile(fileobj=fh, mode="rb"),
+    "bzip2": lambda fh: bz2.BZ2File(fh, mode="rb"),
+    "bz2": lambda fh: bz2.BZ2File(fh, mode="rb"),
+}
+# How many volumes bulk_load reads from disk at the same time.
+BULK_LOAD_THREADS: int = 4
+# How many volume headers read_headers reads at the same time.
+HEADER_READ_THREADS: int = 16
+
+# The lowest and highest possible values for each supported data type.
+_SCALAR_RANGES: dict[np.dtype, tuple[float, float]] = {
+    np.dtype(np.uint8): (0., 255.),
+    np.dtype(np.uint16): (0., 65535.),
+    np.dtype(np.int16): (-32768., 32767.),
+}
+# The VTK scalar type for each supported data type.
+_VTK_SCALAR_TYPES: dict[np.dtype, int] = {
+    np.dtype(np.uint8): VTK_UNSIGNED_CHAR,
+    np.dtype(np.uint16): VTK_UNSIGNED_SHORT,
+    np.dtype(np.int16): VTK_SHORT,
+}
+
+# Integer-valued custom header fields, as (field, attribute, description).
+# Fields are parsed in order, so a later field overrides an earlier one
+# that sets the same attribute.
+_INT_FIELDS: tuple[tuple[str, str, str], ...] = (
+    # The slow time-axis index. "scan index" is deprecated; "group index"
+    # is the preferred field label.
+    ("scan index", "group_index", "scan index"),
+    ("group index", "group_index", "group index"),
+    # The fast time-axis index.
+    ("time index", "time_index", "time index"),
+    # How many fast timepoints are associated with this slow time point.
+    ("n times", "n_times", "number of timepoints"),
+)
+
 
 class ImageBounds(NamedTuple):
     x_min: float
@@ -78,12 +136,26 @@ class VolumeImage:
         self.access_time: float = 0.
         # Used to display the volume info bar.
         self.label: str = ""
+        # The inputs the label was last built from, to skip rebuilding it
+        # when nothing has changed.
+        self._label_key: Optional[tuple] = None
         # The header read from the NRRD file.
         self.header: Optional[dict[str, Any]] = None
 
         self.dtype: Optional[np.dtype] = None
         self.switch_endian: bool = False
         self.dims: Optional[npt.NDArray[np.int_]] = None
+        # Plain copies of values derived from the header, so the render path
+        # doesn't need to work them out from NumPy scalars every time.
+        # The "sizes" field exactly as the header gives it.
+        self._sizes: tuple[int, ...] = ()
+        self._n_channels: int = 1
+        self._spatial_dims: tuple[int, int, int] = (0, 0, 0)
+        self._scale_xyz: tuple[float, float, float] = (1., 1., 1.)
+        self._origin_xyz: tuple[float, float, float] = (0., 0., 0.)
+        # The header fields the values above were derived from.
+        self._geometry_key: Optional[tuple] = None
+        self._scalar_range: tuple[float, float] = (0., 255.)
         self.origin: npt.NDArray[np.float64] = np.zeros((3,), np.float64)
         self.scale: npt.NDArray[np.float64] = np.ones((3,), np.float64)
         self.period: float = 1.
@@ -92,193 +164,246 @@ class VolumeImage:
         self.group_index: int = 0
         self.time_index: int = 0
         self.n_times: int = 1
+        # The number of scalars in the image, counting every channel.
+        self._n_voxels: int = 0
 
-    def read_header(self) -> Optional[FileError]:
+    def read_header(self, template: Optional["VolumeImage"] = None) -> Optional[FileError]:
         """Attempts to load the NRRD header file.
 
         Populates relevant values from the header into this object.
         Returns an error message if the header failed to load.
+
+        :param template: A volume whose header has already been read. If its
+            data type, size, and placement fields match this header's, they
+            are copied from it instead of being validated again.
         """
 
+        logger.debug(f"Reading header from {self.path}...")
         try:
-            logger.debug(f"Reading header from {self.path}...")
-            try:
-                with np.errstate(all="raise"):
-                    header = nrrd.read_header(self.path)
-            except StopIteration:
-                # There is a bug in the NRRD reader library where empty
-                # files will cause the reader to crash with this error.
-                return FileError("Blank or corrupt file", self.path)
-            except ValueError as e:
-                # The NRRD reader cannot handle numeric fields holding text.
-                return FileError(f"Invalid header field: {e}", self.path)
-            except FloatingPointError as e:
-                return FileError(f"Bad numeric data in header field: {e}", self.path)
-            except nrrd.NRRDError as e:
-                return FileError(f"Invalid NRRD file: {e}", self.path)
-            except OSError as e:
-                # Either the file doesn't exist, it's already open, or we don't have permission.
-                return FileError(f"Failed to open the file: {e}", self.path)
+            with np.errstate(all="raise"):
+                header = nrrd.read_header(self.path)
+        except StopIteration:
+            # There is a bug in the NRRD reader library where empty
+            # files will cause the reader to crash with this error.
+            return FileError("Blank or corrupt file", self.path)
+        except ValueError as e:
+            # The NRRD reader cannot handle numeric fields holding text.
+            return FileError(f"Invalid header field: {e}", self.path)
+        except FloatingPointError as e:
+            return FileError(f"Bad numeric data in header field: {e}", self.path)
+        except nrrd.NRRDError as e:
+            return FileError(f"Invalid NRRD file: {e}", self.path)
+        except OSError as e:
+            # Either the file doesn't exist, it's already open, or we don't have permission.
+            return FileError(f"Failed to open the file: {e}", self.path)
+        except Exception as e:
+            return FileError(f"Uncaught error while parsing header: {e}", self.path)
 
-            # Parse the data type to the usual NumPy equivalent so we can check
-            # the number of bytes needed to load this into memory before doing so.
-            try:
-                # This member is protected, but it shouldn't be.
-                # noinspection PyProtectedMember
-                self.dtype = nrrd.reader._determine_datatype(header)
-            except nrrd.NRRDError as e:
-                return FileError(f"Invalid NRRD file: {e}", self.path)
-            self.switch_endian = not self.dtype.isnative
-            if self.switch_endian:
-                self.dtype = self.dtype.newbyteorder()
-            if self.dtype not in [np.uint8, np.uint16, np.int16]:
-                return FileError(f"Pixel data type {self.dtype} is unsupported (uint8, uint16, int16 only)",
-                                 self.path)
-            # [C,X,Y,Z] array size in pixels.
-            self.dims = header["sizes"]
-            if self.dims.size not in [3, 4]:
-                return FileError(f"{self.dims.size}-D images are not supported (3- or 4-D only)", self.path)
-            if self.dims.size == 3:
-                self.dims = np.concatenate((np.ones(1, np.int_), self.dims), axis=0)
-            n_channels: np.int_ = self.dims[0]
-            if n_channels > 4:
-                return FileError(f"{n_channels}-channel images are not supported (4 max)", self.path)
-            # XYZ voxel dimensions in microns.
-            directions: npt.NDArray[np.float64] = header["space directions"]
-            if directions.shape == (4, 3):
-                # Sometimes directions will be specified for the channel. These can be ignored.
-                directions = directions[1:, :]
-            elif directions.shape != (3, 3):
-                return FileError("The space directions are malformed", self.path)
-            if np.any(np.isinf(directions)):
-                return FileError("The space directions contain +/- infinity", self.path)
-            np.nan_to_num(directions, copy=False, nan=0)
-            # We do not attempt to interpret skew or rotation of the "space directions" matrix.
-            self.scale = np.linalg.norm(directions, axis=1)
-            if np.any(self.scale <= 0):
-                return FileError("The space directions are not positive", self.path)
-            # XYZ center offset in pixels.
-            if "space origin" in header:
-                self.origin = header["space origin"]
-                if np.any(np.isinf(self.origin)):
-                    return FileError("The origin contains +/- infinity", self.path)
-                np.nan_to_num(self.origin, copy=False, nan=0)
-            else:
-                # Center the volume.
-                self.origin = -(self.scale * self.dims[1:])/2
-
-            # Custom fields. 5D datasets have a slow and a fast time-axis. The
-            # slow axis is the time between acquisition sessions, while the fast
-            # axis is within a single acquisition.
-
-            # The slow time-axis index. "scan index" is deprecated;
-            # "group index" is the preferred field label.
-            try:
-                self.group_index = int(header["scan index"])
-            except ValueError:
-                return FileError(f"Non-integer scan index", self.path)
-            except KeyError:
-                pass
-            try:
-                self.group_index = int(header["group index"])
-            except ValueError:
-                return FileError(f"Non-integer group index", self.path)
-            except KeyError:
-                pass
-            if self.group_index < 0:
-                return FileError(f"Negative group index", self.path)
-            # The fast time-axis index.
-            try:
-                self.time_index = int(header["time index"])
-            except ValueError:
-                return FileError(f"Non-integer time index", self.path)
-            except KeyError:
-                pass
-            if self.time_index < 0:
-                return FileError(f"Negative time index", self.path)
-            # How many fast timepoints are associated with this slow time
-            # point.
+        try:
+            return self._parse_header(header, template)
+        except Exception as e:
+            return FileError(f"Uncaught error while parsing header: {e}", self.path)
+
+    def _parse_header(self,
+                      header: dict[str, Any],
+                      template: Optional["VolumeImage"]) -> Optional[FileError]:
+        """Populate this object from the fields of a freshly read header.
+
+        Returns an error message if a field is missing or invalid.
+        """
+
+        # Volumes in a series usually share their geometry, so a volume read
+        # earlier can supply it rather than it being validated again.
+        geometry_key = _geometry_key(header)
+        if (template is not None
+                and template.header is not None
+                and template._geometry_key == geometry_key):
+            self._copy_geometry(template)
+        else:
+            error_msg = self._parse_geometry(header)
+            if error_msg is not None:
+                return error_msg
+        self._geometry_key = geometry_key
+
+        # Custom fields. 5D datasets have a slow and a fast time-axis. The
+        # slow axis is the time between acquisition sessions, while the fast
+        # axis is within a single acquisition.
+
+        for field, attr, description in _INT_FIELDS:
+            value = header.get(field)
+            if value is None:
+                continue
             try:
-                self.n_times = int(header["n times"])
+                setattr(self, attr, int(value))
             except ValueError:
-                return FileError(f"Non-integer number of timepoints", self.path)
-            except KeyError:
-                pass
-            if self.n_times < 1:
-                return FileError(f"Non-positive number of timepoints (need at least one)", self.path)
-            # The slow time-axis. The number of minutes since the initial
-            # acquisition.
+                return FileError(f"Non-integer {description}", self.path)
+        if self.group_index < 0:
+            return FileError(f"Negative group index", self.path)
+        if self.time_index < 0:
+            return FileError(f"Negative time index", self.path)
+        if self.n_times < 1:
+            return FileError(f"Non-positive number of timepoints (need at least one)", self.path)
+        # The slow time-axis. The number of minutes since the initial
+        # acquisition.
+        self.timestamp = header.get("timestamp", self.timestamp)
+        if self.timestamp is not None and len(self.timestamp) > 20:
+            return FileError(f"Excessively long timestamp ({len(self.timestamp)} characters)", self.path)
+        # The length of the short time-axis. How long between this volume
+        # acquisition and the next. This is usually constant within a series
+        # of acquisitions, and especially within an acquisition.
+        period = header.get("period")
+        if period is not None:
             try:
-                self.timestamp = header["timestamp"]
-            except KeyError:
-                pass
-            if self.timestamp is not None and len(self.timestamp) > 20:
-                return FileError(f"Excessively long timestamp ({len(self.timestamp)} characters)", self.path)
-            # The length of the short time-axis. How long between this volume
-            # acquisition and the next. This is usually constant within a series
-            # of acquisitions, and especially within an acquisition.
-            try:
-                self.period = float(header["period"])
+                self.period = float(period)
             except ValueError:
                 return FileError(f"Non-numeric t1 sample period", self.path)
-            except KeyError:
-                pass
-            if self.period < 0 or math.isnan(self.period) or math.isinf(self.period):
-                return FileError(f"Period is not a real number", self.path)
-            try:
-                self.period_unit = header["period unit"]
-            except KeyError:
-                pass
-            if len(self.period_unit) > 20:
-                return FileError(
-                    f"Excessively long period unit ({len(self.period_unit)} characters)", self.path)
-            self.header = header
-            return None  # No error message to report.
-        except Exception as e:
-            return FileError(f"Uncaught error while parsing header: {e}", self.path)
+        if self.period < 0 or math.isnan(self.period) or math.isinf(self.period):
+            return FileError(f"Period is not a real number", self.path)
+        self.period_unit = header.get("period unit", self.period_unit)
+        if len(self.period_unit) > 20:
+            return FileError(
+                f"Excessively long period unit ({len(self.period_unit)} characters)", self.path)
+        self.header = header
+        return None  # No error message to report.
+
+    def _parse_geometry(self, header: dict[str, Any]) -> Optional[FileError]:
+        """Populate the data type, size, and placement of the volume.
+
+        Returns an error message if a field is missing or invalid.
+        """
+
+        # Parse the data type to the usual NumPy equivalent so we can check
+        # the number of bytes needed to load this into memory before doing so.
+        try:
+            # This member is protected, but it shouldn't be.
+            # noinspection PyProtectedMember
+            self.dtype = nrrd.reader._determine_datatype(header)
+        except nrrd.NRRDError as e:
+            return FileError(f"Invalid NRRD file: {e}", self.path)
+        self.switch_endian = not self.dtype.isnative
+        if self.switch_endian:
+            self.dtype = self.dtype.newbyteorder()
+        if self.dtype not in _SCALAR_RANGES:
+            return FileError(f"Pixel data type {self.dtype} is unsupported (uint8, uint16, int16 only)",
+                             self.path)
+        self._scalar_range = _SCALAR_RANGES[self.dtype]
+        # [C,X,Y,Z] array size in pixels.
+        self.dims = header["sizes"]
+        self._sizes = tuple(self.dims.tolist())
+        if self.dims.size not in [3, 4]:
+            return FileError(f"{self.dims.size}-D images are not supported (3- or 4-D only)", self.path)
+        if self.dims.size == 3:
+            self.dims = np.concatenate((np.ones(1, np.int_), self.dims), axis=0)
+        self._n_channels = int(self.dims[0])
+        self._spatial_dims = (int(self.dims[1]), int(self.dims[2]), int(self.dims[3]))
+        nx, ny, nz = self._spatial_dims
+        self._n_voxels = self._n_channels * nx * ny * nz
+        if self._n_channels > 4:
+            return FileError(f"{self._n_channels}-channel images are not supported (4 max)", self.path)
+        # XYZ voxel dimensions in microns.
+        directions: npt.NDArray[np.float64] = header["space directions"]
+        if directions.shape == (4, 3):
+            # Sometimes directions will be specified for the channel. These can be ignored.
+            directions = directions[1:, :]
+        elif directions.shape != (3, 3):
+            return FileError("The space directions are malformed", self.path)
+        if np.any(np.isinf(directions)):
+            return FileError("The space directions contain +/- infinity", self.path)
+        np.nan_to_num(directions, copy=False, nan=0)
+        # We do not attempt to interpret skew or rotation of the "space directions" matrix.
+        self.scale = np.linalg.norm(directions, axis=1)
+        if np.any(self.scale <= 0):
+            return FileError("The space directions are not positive", self.path)
+        # XYZ center offset in pixels.
+        if "space origin" in header:
+            self.origin = header["space origin"]
+            if np.any(np.isinf(self.origin)):
+                return FileError("The origin contains +/- infinity", self.path)
+            np.nan_to_num(self.origin, copy=False, nan=0)
+        else:
+            # Center the volume.
+            self.origin = -(self.scale * self.dims[1:])/2
+        self._scale_xyz = tuple(self.scale.tolist())
+        self._origin_xyz = tuple(self.origin.tolist())
+        return None
+
+    def _copy_geometry(self, template: "VolumeImage") -> None:
+        """Take the data type, size, and placement from another volume."""
+
+        self.dtype = template.dtype
+        self.switch_endian = template.switch_endian
+        self._scalar_range = template._scalar_range
+        self.dims = template.dims
+        self._sizes = template._sizes
+        self._n_channels = template._n_channels
+        self._spatial_dims = template._spatial_dims
+        self._n_voxels = template._n_voxels
+        self.scale = template.scale
+        self.origin = template.origin
+        self._scale_xyz = template._scale_xyz
+        self._origin_xyz = template._origin_xyz
 
     def estimate_memory(self) -> int:
         """Estimate how many bytes the file will take if loaded into memory."""
 
         assert self.header is not None, "You need to call 'read_header' first."
-        return self.dtype.itemsize * int(np.product(self.dims))
+        return self.dtype.itemsize * self._n_voxels
+
+    def loaded_memory(self) -> int:
+        """How many bytes the loaded image takes, or zero if it isn't loaded.
+
+        This is less than the estimate when the image was narrowed to 8 bits.
+        """
+
+        image = self.image
+        return 0 if image is None else image.nbytes
 
     def get_scalar_range(self) -> tuple[float, float]:
         """The lowest and highest possible values for this image data type."""
 
         assert self.header is not None, "You need to call 'read_header' first."
-        if self.dtype == np.uint8:
-            return 0., 255.
-        if self.dtype == np.uint16:
-            return 0., 65535.
-        if self.dtype == np.int16:
-            return -32768., 32767.
-        raise RuntimeError(f"Unsupported data type: {self.dtype}.")
+        return self._scalar_range
 
     def n_channels(self) -> int:
         """The number of independent color channels this volume contains."""
 
         assert self.header is not None, "You need to call 'read_header' first."
-        return int(self.dims[0])
+        return self._n_channels
 
-    def load(self) -> Optional[FileError]:
+    def load(self, narrow_to_uint8: bool = False) -> Optional[FileError]:
         """Loads the data from the NRRD file into memory.
 
-        Returns an error message if the file was unreadable.
+        :param narrow_to_uint8: Store a 16-bit volume as 8-bit when none of
+            its values need more than 8 bits. No value changes, but the volume
+            takes half the memory and GPU upload time, at the cost of one pass
+            over it as it loads. For a memory-mapped file, that pass reads
+            the whole file up front.
+        :return: An error message if the file was unreadable.
         """
 
         assert self.header is not None, "You need to call 'read_header' first."
 
+        # Skip the lock when the volume is already loaded, as it usually is
+        # when rendering. The VTK image is the last thing set by loading and
+        # the first thing cleared by unloading, so seeing it means loading
+        # has finished.
+        if self._vtk_image is not None:
+            return None
         with self.load_lock:
             if self.is_loaded():
                 return None
 
             logger.info(f"Loading data from {self.path}...")
             try:
-                # Transposing an array is slow, so we store it in the native
-                # format: [Z,Y,X,C]. The axis order needs to be inverted because
-                # we use C-style indexing rather than Fortran-style indexing.
-                self.image, header = nrrd.read(self.path, index_order="C")
+                with open(self.path, "rb") as fh:
+                    header = nrrd.read_header(fh)
+                    # Check that the data is at least the same shape as what we expected.
+                    # It is still possible for a different file to be loaded than the one whose header was read,
+                    # but at least it will be the same size and data type.
+                    if (self.header["type"] != header["type"]
+                            or self._sizes != tuple(header["sizes"].tolist())):
+                        return self._fail_load("File has changed since the header was initially read")
+                    self.image = self._read_data(header, fh)
             except StopIteration:
                 # There is a bug in the NRRD reader library where empty
                 # files will cause the reader to crash with this error.
@@ -296,64 +421,207 @@ class VolumeImage:
 
             assert self.image is not None, "The NRRD reader failed silently and returned None."
 
-            # Check that the data is at least the same shape as what we expected.
-            # It is still possible for a different file to be loaded than the one whose header was read,
-            # but at least it will be the same size and data type.
-            if (self.header["type"] != header["type"]
-                    or self.header["sizes"].shape != header["sizes"].shape
-                    or np.any(self.header["sizes"] != header["sizes"])):
-                return self._fail_load("File has changed since the header was initially read")
-
             # Channel-less images need to reshaped to have one channel.
             if len(self.image.shape) == 3:
                 self.image = self.image.reshape(self.dims)
-            # The endianness needs to be native for VTK to display properly.
-            if self.switch_endian:
-                self.image.byteswap(True)
+            # VTK reads the array's memory directly. Both readers already
+            # produce contiguous arrays, so this is just a safeguard.
+            self.image = np.ascontiguousarray(self.image)
+            if narrow_to_uint8 and self.dtype != np.uint8:
+                self.image = _narrow_to_uint8(self.image)
             self._make_vtk_image()
 
         # No error message to report.
         return None
 
+    def _read_data(self, header: dict[str, Any], fh: BinaryIO) -> npt.NDArray:
+        """Read the image data belonging to a freshly read header.
+
+        Raw and compressed data are read straight into their final array, a
+        large chunk at a time, without the intermediate copies of the NRRD
+        reader. Text encodings are left to the NRRD reader.
+
+        The endianness needs to be native for VTK to display properly, so the
+        bytes are swapped as needed.
+
+        :param header: The header just read from 'fh'.
+        :param fh: The NRRD file, positioned at the end of the header.
+        :return: The image in native byte order.
+        """
+
+        # These fields may be written with or without the space.
+        line_skip: int = header.get("lineskip", header.get("line skip", 0))
+        byte_skip: int = header.get("byteskip", header.get("byte skip", 0))
+        data_file: Optional[str] = header.get("datafile", header.get("data file"))
+        decompressor = _DECOMPRESSORS.get(header["encoding"])
+        # Compressed data with a byte skip of -1 ends some unknown distance
+        # into the decompressed stream, so the whole stream is needed first.
+        if (header["encoding"] != "raw" and decompressor is None) or (
+                decompressor is not None and byte_skip == -1):
+            # Transposing an array is slow, so we store it in the native
+            # format: [Z,Y,X,C]. The axis order needs to be inverted because
+            # we use C-style indexing rather than Fortran-style indexing.
+            image = nrrd.read_data(header, fh, self.path, index_order="C")
+            if self.switch_endian:
+                # Swap in place, then relabel the array with the native
+                # type so NumPy reads the swapped values correctly, too.
+                image.byteswap(True)
+                image = image.view(self.dtype)
+            return image
+
+        if line_skip < 0:
+            raise nrrd.NRRDError("Invalid lineskip, allowed values are greater than or equal to 0")
+        if byte_skip < -1:
+            raise nrrd.NRRDError("Invalid byteskip, allowed values are greater than or equal to -1")
+
+        # The same [Z,Y,X,C] layout the NRRD reader produces.
+        shape = tuple(header["sizes"][::-1].tolist())
+        if data_file is None:
+            return self._read_payload(fh, decompressor, shape, line_skip, byte_skip)
+        # A detached header names the data file relative to itself.
+        data_path = os.path.join(os.path.dirname(self.path), data_file)
+        with open(data_path, "rb") as data_fh:
+            return self._read_payload(data_fh, decompressor, shape, line_skip, byte_skip)
+
+    def _read_payload(self,
+                      fh: BinaryIO,
+                      decompressor: Optional[Callable[[BinaryIO], BinaryIO]],
+                      shape: tuple[int, ...],
+                      line_skip: int,
+                      byte_skip: int) -> npt.NDArray:
+        """Read raw or compressed image data from a file.
+
+        Raw data already in native byte order is memory-mapped rather than
+        read, so loading is nearly instant and the OS pages the data in from
+        disk in the background. Any other data is read into memory a chunk at
+        a time, decompressing it as it streams in.
+
+        :param fh: The file holding the data, positioned before any skips.
+        :param decompressor: Wraps 'fh' to decompress it, or None for raw data.
+        :param shape: The shape of the image array.
+        :param line_skip: The number of lines to skip before the data.
+        :param byte_skip: The number of bytes to skip after the lines, or -1
+            if the data is at the very end of the file. Compressed data is
+            skipped after decompressing it.
+        :return: The image in native byte order.
+        """
+
+        for _ in range(line_skip):
+            fh.readline()
+
+        if decompressor is not None:
+            _advise_read_once(fh)
+            image = np.empty(shape, self.dtype)
+            with decompressor(fh) as stream:
+                if byte_skip > 0:
+                    stream.seek(byte_skip)
+                self._read_into(image, stream, self.switch_endian)
+            return image
+
+        n_bytes = self._n_voxels * self.dtype.itemsize
+        if byte_skip == -1:
+            offset = fh.seek(-n_bytes, os.SEEK_END)
+        else:
+            offset = fh.seek(byte_skip, os.SEEK_CUR)
+
+        if self.switch_endian:
+            _advise_read_once(fh)
+            image = np.empty(shape, self.dtype)
+            self._read_into(image, fh, True)
+            return image
+
+        n_available = (os.fstat(fh.fileno()).st_size - offset) // self.dtype.itemsize
+        if n_available < self._n_voxels:
+            raise _size_error(self._n_voxels, n_available)
+        # The map holds its own handle to the file, so it outlives 'fh'. The
+        # array keeps the map open for as long as the array is in use.
+        data_map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            # Start paging the data in now so it is resident by the time
+            # it is rendered. Not every platform supports this.
+            data_map.madvise(mmap.MADV_WILLNEED)
+        return np.frombuffer(data_map, self.dtype, self._n_voxels, offset).reshape(shape)
+
+    @staticmethod
+    def _read_into(image: npt.NDArray, fh: BinaryIO, swap: bool) -> None:
+        """Fill a preallocated image with data from a file.
+
+        :param image: A C-contiguous array to hold the data.
+        :param fh: The file or stream holding the data, positioned at its start.
+        :param swap: Whether to swap the byte order of the data as it is read.
+        """
+
+        flat = image.reshape(-1)
+        buffer = memoryview(flat.view(np.uint8))
+        n_read = 0
+        n_swapped = 0
+        while n_read < len(buffer):
+            try:
+                n = fh.readinto(buffer[n_read:n_read + READ_CHUNK_SIZE])
+            except EOFError:
+                # The compressed stream was cut short. Treat it like a short
+                # file, whose size is reported below.
+                break
+            if not n:
+                break
+            n_read += n
+            if swap:
+                # Swap each chunk while it is still in the CPU cache, rather
+                # than making a second pass over the whole image afterwards.
+                # A short read may split an item, so only whole items are
+                # swapped and the rest waits for the next chunk.
+                n_items = n_read // image.itemsize
+                flat[n_swapped:n_items].byteswap(True)
+                n_swapped = n_items
+        if n_read < len(buffer):
+            raise _size_error(image.size, n_read // image.itemsize)
+
     def _fail_load(self, message: str) -> FileError:
         """Sets up the image with a default array when loading it fails.
 
         Returns an error message object to be passed along.
         """
 
-        self.image = np.zeros(self.dims, np.uint8)
-        self._make_vtk_image()
+        # VTK still needs an image to point at, but it doesn't need to be
+        # full size, which could take gigabytes. A blank image with two
+        # samples along each axis, spread over the same bounds, will do.
+        self.image = np.zeros((2, 2, 2, self._n_channels), self.dtype)
+        self._make_vtk_image((2, 2, 2), tuple(
+            s * max(n - 1, 1) for s, n in zip(self._scale_xyz, self._spatial_dims)))
         return FileError(message, self.path)
 
-    def _make_vtk_image(self) -> None:
-        """Create the VTK image data object for viewing."""
-
-        self._vtk_image = vtkImageImport()
-        self._vtk_image.SetImportVoidPointer(self.image.ravel())
-        if self.dtype == np.uint8:
-            self._vtk_image.SetDataScalarTypeToUnsignedChar()
-        elif self.dtype == np.uint16:
-            self._vtk_image.SetDataScalarTypeToUnsignedShort()
-        elif self.dtype == np.int16:
-            self._vtk_image.SetDataScalarTypeToShort()
-        else:
-            raise RuntimeError("It is supposed to be impossible to set the wrong data type.")
-        self._vtk_image.SetNumberOfScalarComponents(self.dims[0])
-        self._vtk_image.SetDataExtent(
-            0, self.dims[1] - 1,
-            0, self.dims[2] - 1,
-            0, self.dims[3] - 1
-        )
-        self._vtk_image.SetWholeExtent(
-            0, self.dims[1] - 1,
-            0, self.dims[2] - 1,
-            0, self.dims[3] - 1
-        )
-        self._vtk_image.SetDataSpacing(self.scale)
-        self._vtk_image.SetDataOrigin(self.origin)
+    def _make_vtk_image(self,
+                        spatial_dims: Optional[tuple[int, int, int]] = None,
+                        spacing: Optional[tuple[float, float, float]] = None) -> None:
+        """Create the VTK image data object for viewing.
+
+        :param spatial_dims: The number of samples along each axis, if not
+            the size given by the header.
+        :param spacing: The distance between samples along each axis, if
+            not the voxel size given by the header.
+        """
+
+        vtk_image = vtkImageImport()
+        assert self.image.flags.c_contiguous, "VTK needs the image to be contiguous."
+        # VTK takes the address of the array's buffer and renders from it
+        # directly; neither the import nor the pipeline copies the data.
+        vtk_image.SetImportVoidPointer(self.image)
+        # The array may be narrower than the file's data type; see
+        # "narrow_to_uint8" in load.
+        vtk_image.SetDataScalarType(_VTK_SCALAR_TYPES[self.image.dtype])
+        vtk_image.SetNumberOfScalarComponents(self._n_channels)
+        nx, ny, nz = self._spatial_dims if spatial_dims is None else spatial_dims
+        extent = (0, nx - 1, 0, ny - 1, 0, nz - 1)
+        vtk_image.SetDataExtent(extent)
+        vtk_image.SetWholeExtent(extent)
+        vtk_image.SetDataSpacing(self._scale_xyz if spacing is None else spacing)
+        vtk_image.SetDataOrigin(self._origin_xyz)
         # By keeping a handle to the underlying array data, we can avoid
         # VTK access violations related to premature garbage collection.
-        self._vtk_image._array_data = self.image
+        vtk_image._array_data = self.image
+        # Publish the image only once it is fully set up, since 'load' checks
+        # for it without holding the lock.
+        self._vtk_image = vtk_image
 
     def unload(self) -> None:
         """Frees the memory containing the image data.
@@ -363,8 +631,14 @@ class VolumeImage:
         """
 
         with self.load_lock:
-            self.image = None
+            # The importer is dropped along with the array rather than kept
+            # for the next load. The timeline may evict the volume that is
+            # still connected to a mapper, and the importer pins its array
+            # until the mapper lets go of it. Reusing the importer would
+            # mean unpinning the array here and leaving VTK a dangling
+            # pointer.
             self._vtk_image = None
+            self.image = None
 
     def is_loaded(self) -> bool:
         """Determines if the data in this volume has been loaded from disk."""
@@ -384,6 +658,12 @@ class VolumeImage:
         :param n_volumes: The total number of volume in the timeline.
         """
 
+        key = (time_sum, index, n_volumes, self.group_index, self.timestamp,
+               self.time_index, self.n_times, self.period_unit)
+        if key == self._label_key:
+            return
+        self._label_key = key
+
         timestamp = str(self.group_index)
         if self.timestamp is not None:
             timestamp += " (" + self.timestamp + ")"
@@ -399,20 +679,24 @@ class VolumeImage:
         """Returns a handle to the VTK image."""
 
         self.access_time = time.time()
-        self.load()
-        return self._vtk_image
+        vtk_image = self._vtk_image
+        if vtk_image is None:
+            self.load()
+            vtk_image = self._vtk_image
+        return vtk_image
 
     def bounds(self) -> ImageBounds:
         """The min and max extents of the image in VTK world coordinates."""
 
         assert self.header is not None, "You need to call 'read_header' first."
 
-        lower = self.origin
-        upper = self.origin + self.scale * self.dims[1:]
+        ox, oy, oz = self._origin_xyz
+        sx, sy, sz = self._scale_xyz
+        nx, ny, nz = self._spatial_dims
         return ImageBounds(
-            lower[0], upper[0],
-            lower[1], upper[1],
-            lower[2], upper[2]
+            ox, ox + sx * nx,
+            oy, oy + sy * ny,
+            oz, oz + sz * nz
         )
 
     def view_scale(self) -> float:
@@ -422,7 +706,7 @@ class VolumeImage:
         """
 
         assert self.header is not None, "You need to call 'read_header' first."
-        return 1.5 * np.max(self.scale * self.dims[1:]) / 2
+        return 1.5 * max(s * n for s, n in zip(self._scale_xyz, self._spatial_dims)) / 2
 
     def histogram(self, i_chan: int, step: int = 4) -> npt.NDArray[np.int64]:
         """Compute the histogram for a certain channel.
@@ -446,3 +730,148 @@ class VolumeImage:
         #                       bins=min(100000, int(high - low + 1)),
         #                       range=(low, high))[0]
         return np.histogram(self.image[::step, ::step, ::step, i_chan], bins=bins)[0]
+
+
+def _size_error(n_expected: int, n_found: int) -> nrrd.NRRDError:
+    """The error for a data file holding fewer items than its header describes.
+
+    The message matches the one the NRRD reader gives for the same problem.
+    """
+
+    return nrrd.NRRDError(
+        f"Size of the data does not equal the product of all the dimensions: "
+        f"{n_expected}-{n_found}={n_expected - n_found}")
+
+
+def _geometry_key(header: dict[str, Any]) -> tuple:
+    """The header fields that determine a volume's data type, size, and placement.
+
+    Two headers with equal keys produce the same geometry.
+    """
+
+    def array_key(x: Optional[npt.NDArray]) -> Optional[tuple]:
+        return None if x is None else (x.shape, x.dtype.str, x.tobytes())
+
+    return (
+        header.get("type"),
+        header.get("endian"),
+        array_key(header.get("sizes")),
+        array_key(header.get("space directions")),
+        array_key(header.get("space origin")),
+    )
+
+
+def _narrow_to_uint8(image: npt.NDArray) -> npt.NDArray:
+    """Convert an image to uint8 if that doesn't change any of its values.
+
+    The values are not rescaled, so the scalar range, histograms, and
+    transfer functions set for the original data type all still apply.
+
+    :param image: The image to convert.
+    :return: The converted image, or the original if any value is out of range.
+    """
+
+    if image.size == 0 or image.max() > 255:
+        return image
+    if image.dtype.kind == "i" and image.min() < 0:
+        return image
+    return image.astype(np.uint8)
+
+
+def _advise_read_once(fh: BinaryIO) -> None:
+    """Hint to the OS that a file will be read start to finish, just once.
+
+    Data copied out of the file into an array has no use staying in the
+    page cache, so this lets the OS read ahead further and evict the pages
+    sooner rather than pushing out more useful ones. Memory-mapped data
+    shouldn't get this hint, since the page cache is its only copy.
+    """
+
+    if not hasattr(os, "posix_fadvise"):
+        return  # Not every platform supports this.
+    fd = fh.fileno()
+    # The hint is only advisory, so a file system that rejects it must
+    # never fail the read.
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+        pass
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+    except OSError:
+        pass
+
+
+def bulk_load(volumes: Iterable[VolumeImage],
+              max_workers: int = BULK_LOAD_THREADS,
+              narrow_to_uint8: bool = False,
+              stop: Optional[Callable[[], bool]] = None) -> list[FileError]:
+    """Load several volumes at once rather than one after another.
+
+    Reading from disk releases the GIL, so loading each volume on its own
+    worker keeps several reads queued with the drive at a time. The total
+    time then approaches that of the slowest file instead of the sum of them.
+
+    :param volumes: The volumes to load. Each must have its header read.
+    :param max_workers: The most volumes to read from disk at the same time.
+    :param narrow_to_uint8: Passed on to VolumeImage.load.
+    :param stop: Checked before each volume starts loading. Once it returns
+        true, the volumes not yet started are skipped and left unloaded.
+    :return: The errors from any volumes that failed to load.
+    """
+
+    def load(v: VolumeImage) -> Optional[FileError]:
+        if stop is not None and stop():
+            return None
+        return v.load(narrow_to_uint8)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        errors = list(executor.map(load, volumes))
+    return [e for e in errors if e is not None]
+
+
+def read_headers(
+        paths: Iterable[str],
+        max_workers: int = HEADER_READ_THREADS
+) -> Iterator[tuple[int, VolumeImage, Optional[FileError]]]:
+    """Create a volume for each file and read their headers several at a time.
+
+    A header is small, so reading one is mostly waiting on the file system,
+    which releases the GIL. Reading many at once overlaps that waiting.
+
+    The first header is read on its own and then serves as the template for
+    the rest, so volumes sharing its geometry skip validating it again.
+
+    Results are yielded as each header is read rather than in order, so the
+    caller can report progress. Closing the iterator early cancels the reads
+    not yet started; headers already being read are left to finish.
+
+    :param paths: The NRRD or NHDR file for each volume.
+    :param max_workers: The most headers to read at the same time.
+    :return: Iterates over the index of each path, the volume made for it,
+        and the error from reading its header, if any.
+    """
+
+    def read(path: str, template: Optional[VolumeImage]) -> tuple[VolumeImage, Optional[FileError]]:
+        v = VolumeImage(path)
+        return v, v.read_header(template)
+
+    paths = list(paths)
+    if not paths:
+        return
+    template, error_msg = read(paths[0], None)
+    yield 0, template, error_msg
+    if error_msg is not None:
+        template = None
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        future_to_index = {
+            executor.submit(read, path, template): i
+            for i, path in enumerate(paths[1:], 1)
+        }
+        for future in as_completed(future_to_index):
+            v, error_msg = future.result()
+            yield future_to_index[future], v, error_msg
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -27,17 +27,20 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import IntEnum
 import logging
 from threading import Lock
 from typing import (
+    Iterator,
+    NamedTuple,
     Optional,
     Sequence,
 )
 
 import numpy as np
 import numpy.typing as npt
-from scipy.spatial.distance import cdist  # type: ignore
+import scipy.linalg
 from vtkmodules.vtkCommonCore import (
     vtkDataArray,
     vtkPoints,
@@ -47,6 +50,7 @@ from vtkmodules.vtkCommonDataModel import (
     vtkImageData,
     vtkStructuredGrid,
 )
+from vtkmodules.util.numpy_support import numpy_to_vtk
 from vtkmodules.vtkFiltersGeometry import vtkStructuredGridGeometryFilter
 from vtkmodules.vtkRenderingCore import (
     vtkActor,
@@ -61,6 +65,26 @@ from main.volumeimage import (
 
 logger = logging.getLogger(__name__)
 
+# The spline is evaluated over the grid this many points at a time, so that
+# the radial distances for each block stay in the CPU cache rather than
+# being built for the whole grid at once.
+DEP_VAR_BLOCK_SIZE: int = 1 << 13
+# The most memory, in bytes, to spend keeping the radial distances from the
+# mask grid to the control points between mask updates. Larger grids are
+# evaluated afresh each time.
+PHI_CACHE_BYTES: int = 1 << 26
+# Fits with at least this many control points are solved as symmetric
+# systems, which takes about half the work of a general solve. Smaller ones
+# are over too quickly for that to outweigh SciPy's call overhead.
+SYM_SOLVE_MIN_CTRL: int = 150
+# The mask is filled by this many threads at once, each taking a slab of
+# whole Z slices. NumPy releases the GIL while filling, so they can run on
+# separate cores.
+MASK_FILL_THREADS: int = 4
+# Masks with fewer voxels than this are filled on the calling thread, since
+# starting the threads would take longer than the fill.
+MASK_FILL_MIN_VOXELS: int = 1 << 22
+
 
 class MaskUpdate(IntEnum):
     """Enumerates the state of progress towards a complete mask computation.
@@ -77,6 +101,35 @@ class MaskUpdate(IntEnum):
     NONE = 2
 
 
+class _SplineFit(NamedTuple):
+    """A fitted spline, split up ready for evaluation.
+
+    The mesh and the mask are both evaluated from the same fit, so the
+    parameters are split into their radial and affine parts only once.
+    """
+
+    # The radial weights, one per control point. Shape: (n_c, 1)
+    alpha: npt.NDArray[np.float32]
+    # The affine terms: dep = b0 + b1*a0 + b2*a1.
+    b: tuple[float, float, float]
+    # The control points the fit was made with, along the independent axes.
+    i_ctrl: npt.NDArray[np.float32]
+
+
+class _MaskGrid(NamedTuple):
+    """The layout of the mask grid in the volume along the current axis."""
+
+    # The size of the mask. Shape: XYZ
+    v_dims: npt.NDArray[np.uint64]
+    # The dependent axis's origin, voxel size, and voxel count.
+    a_offset: np.float32
+    a_scale: np.float32
+    a_dim: np.uint64
+    # The grid axes for the two independent axes, from _make_grid_axes.
+    a0: npt.NDArray[np.float32]
+    a1: npt.NDArray[np.float32]
+
+
 class VolumeMaskTPS:
     """Stores and calculates the volume mask using a thin-plate spline (TPS).
 
@@ -94,20 +147,66 @@ class VolumeMaskTPS:
         self.upscale: float = 1.
         # The list of control points associated with the UI.
         self.control_points: list[ControlPoint] = []
+        # Maps id(cp) to its index in "self.control_points" so edits don't
+        # need to search the list. The list holds a reference to each
+        # control point, so their IDs can't be reused while they're mapped.
+        self._cp_index: dict[int, int] = {}
+        # The rows of the control array are stored at the start of this
+        # buffer, which doubles in size whenever it fills up, so adding a
+        # control point doesn't need to copy all the others.
+        self._control_buf: npt.NDArray[np.float32] = np.empty((0, 3), np.float32)
         # The Nx3 array of points in world space that control the surface.
         # There is a one-to-one correspondence between these and "self.control_points".
-        self.control_array: npt.NDArray[np.float32] = np.empty((0, 3), np.float32)
+        # This is a view of the first N rows of "self._control_buf".
+        self.control_array: npt.NDArray[np.float32] = self._control_buf[:0]
+        # Contiguous copies of the control array split into the independent
+        # coordinates (Nx2) and the dependent coordinate (Nx1) for the
+        # current axis. These are replaced, never modified, whenever the
+        # control points or the axis change, so other threads may keep using
+        # a copy they took while holding the lock.
+        self._ctrl_ind: npt.NDArray[np.float32] = np.empty((0, 2), np.float32)
+        self._ctrl_dep: npt.NDArray[np.float32] = np.empty((0, 1), np.float32)
 
         self._mask_update: MaskUpdate = MaskUpdate.FULL
-        self.parameters: Optional[npt.NDArray[np.float32]] = None
-        self.dep_indices: Optional[npt.NDArray[np.uint32]] = None
+        self.parameters: Optional[_SplineFit] = None
+        # The radial distances between the control points, which only
+        # depend on the control points and the axis, so they can be reused
+        # when just the regularization changes, and only need updating for
+        # the control points that have moved. "_phi_ctrl_ind" holds the
+        # independent coordinates they were computed for.
+        self._phi_ctrl: Optional[npt.NDArray[np.float32]] = None
+        self._phi_ctrl_ind: Optional[npt.NDArray[np.float32]] = None
+        # The radial distances from each point in the mask grid to the
+        # control points. These don't depend on the regularization or the
+        # direction, so changing those doesn't need them to be rebuilt. Only
+        # accessed while holding "get_vtk_lock".
+        self._phi_grid: Optional[npt.NDArray[np.float32]] = None
+        self._phi_grid_key: Optional[tuple[bytes, ...]] = None
+        # Reused for the spline values on each mask update, so that a new
+        # grid-sized array isn't needed each time. Only accessed while
+        # holding "get_vtk_lock".
+        self._dep_var: Optional[npt.NDArray[np.float32]] = None
+        self.dep_indices: Optional[npt.NDArray[np.int32]] = None
         self.mask: Optional[npt.NDArray[np.uint8]] = None
         self.vtk_data: Optional[vtkImageData] = None
+        # Counts the times the mask has been rewritten, and the count when
+        # "self.vtk_data" was made, so an unchanged mask can reuse it.
+        self._mask_version: int = 0
+        self._vtk_data_version: int = -1
 
         # Volume info:
         self.v_dims: Optional[npt.NDArray[np.uint64]] = None
         self.v_offset: Optional[npt.NDArray[np.float32]] = None
         self.v_scale: Optional[npt.NDArray[np.float32]] = None
+        # The same volume info as plain tuples, which compare much faster
+        # than the arrays when checking whether the volume has changed.
+        self._v_dims_t: Optional[tuple[int, ...]] = None
+        self._v_offset_t: Optional[tuple[float, ...]] = None
+        self._v_scale_t: Optional[tuple[float, ...]] = None
+        # The mask grid for the current volume, up-scale and axis, which only
+        # changes when one of those does.
+        self._mask_grid: Optional[_MaskGrid] = None
+        self._mask_grid_key: Optional[tuple] = None
 
         # Acquire this whenever you modify one on the inputs to mask generation,
         # such as the axis or the control points.
@@ -130,7 +229,9 @@ class VolumeMaskTPS:
         """
 
         logger.debug(f"_reduce_progress: {self._mask_update} -> {new_state}")
-        self._mask_update = min(self._mask_update, new_state)
+        # Lower values are dirtier, so only ever step the state down.
+        if new_state < self._mask_update:
+            self._mask_update = new_state
 
     def set_axis(self, axis: int) -> None:
         """Set the dependent variable index and update the dirtiness.
@@ -147,6 +248,7 @@ class VolumeMaskTPS:
             logger.debug(f"set_axis({axis})")
             if self.axis != axis:
                 self.axis = axis
+                self._split_control_array()
                 self.parameters = None
                 self._reduce_progress(MaskUpdate.FULL)
             else:
@@ -217,7 +319,18 @@ class VolumeMaskTPS:
         axis = self.axis
         return np.hstack((ijk[:axis], ijk[axis + 1:]))
 
-    def _fit(self) -> npt.NDArray[np.float32]:
+    def _split_control_array(self) -> None:
+        """Refresh the independent and dependent copies of the control array.
+
+        You must hold "self.lock" while calling this method to avoid race
+        conditions.
+        """
+
+        # Fancy indexing copies, so these are already contiguous.
+        self._ctrl_ind = self.control_array[:, self._independent_axes()]
+        self._ctrl_dep = self.control_array[:, [self.axis]]
+
+    def _fit(self) -> _SplineFit:
         """Make "parameters" object by fitting the control points.
 
         Called by functions updating the control points. This is very fast
@@ -238,13 +351,14 @@ class VolumeMaskTPS:
         self.params_updated = True
 
         logger.debug("Fitting parameters...")
-        # Axes for the independent variables only.
-        ia = self._independent_axes()
-        ctrl_ind = self.control_array[:, ia]
-        ctrl_dep = self.control_array[:, self.axis].reshape((-1, 1))
+        ctrl_ind = self._ctrl_ind
+        ctrl_dep = self._ctrl_dep
 
         n = self.control_array.shape[0]
-        phi_ctrl = _radial_distance(ctrl_ind, ctrl_ind)
+        phi_ctrl = _update_radial_distance(
+            self._phi_ctrl, self._phi_ctrl_ind, ctrl_ind)
+        self._phi_ctrl = phi_ctrl
+        self._phi_ctrl_ind = ctrl_ind
 
         # Build the linear system AP = Y
         X = np.hstack([np.ones((n, 1), np.float32), ctrl_ind])
@@ -257,11 +371,43 @@ class VolumeMaskTPS:
             np.zeros((3, 1), np.float32)
         ])
         try:
-            self.parameters = np.linalg.solve(A, y)
+            if n < SYM_SOLVE_MIN_CTRL:
+                solution = np.linalg.solve(A, y)
+            else:
+                # A is symmetric but indefinite, which LAPACK's symmetric
+                # solver handles with Bunch-Kaufman pivoting. NumPy solves
+                # single precision systems in double precision, so this
+                # does too; in single precision, the fit loses about three
+                # significant digits. The copies may be overwritten.
+                solution = scipy.linalg.solve(
+                    A.astype(np.float64), y.astype(np.float64),
+                    assume_a="sym",
+                    lower=True,
+                    overwrite_a=True,
+                    overwrite_b=True,
+                    check_finite=False,
+                ).astype(np.float32)
             logger.debug("Parameters fit.")
-        except np.linalg.LinAlgError as e:
-            self.parameters = np.zeros((A.shape[1], 1), np.float32)
-            logger.warning(f"Parameter fitting failed: {e}")
+        except (np.linalg.LinAlgError, ValueError) as e:
+            # Coincident control points, or too few that aren't collinear,
+            # make the system singular. The minimum norm least squares
+            # solution still gives a sensible surface, and LAPACK's complete
+            # orthogonal factorization finds it about as fast as a solve.
+            logger.warning(f"Parameter fitting failed: {e}. Using least squares.")
+            try:
+                solution = scipy.linalg.lstsq(
+                    A.astype(np.float64), y.astype(np.float64),
+                    lapack_driver="gelsy",
+                    check_finite=False,
+                )[0].astype(np.float32)
+            except (np.linalg.LinAlgError, ValueError) as e:
+                solution = np.zeros((A.shape[1], 1), np.float32)
+                logger.warning(f"Least squares fitting failed: {e}")
+        self.parameters = _SplineFit(
+            alpha=solution[:n],
+            b=tuple(solution[n:, 0].tolist()),
+            i_ctrl=ctrl_ind,
+        )
         return self.parameters
 
     def count_cp(self) -> int:
@@ -283,9 +429,16 @@ class VolumeMaskTPS:
             logger.debug(
                 f"Add CP:, {cp.get_origin()} Shape: {self.control_array.shape}"
             )
-            a = np.array(cp.get_origin(), np.float32)
-            self.control_array = np.vstack((self.control_array, a))
+            n = self.control_array.shape[0]
+            if n == self._control_buf.shape[0]:
+                buf = np.empty((max(2 * n, 8), 3), np.float32)
+                buf[:n] = self.control_array
+                self._control_buf = buf
+            self._control_buf[n] = cp.get_origin()
+            self.control_array = self._control_buf[:n + 1]
+            self._cp_index[id(cp)] = len(self.control_points)
             self.control_points.append(cp)
+            self._split_control_array()
             self.parameters = None
             self._reduce_progress(MaskUpdate.PARTIAL)
 
@@ -298,7 +451,7 @@ class VolumeMaskTPS:
         """
 
         with self.lock:
-            i = self.control_points.index(cp)
+            i = self._cp_index.pop(id(cp))
             i_last = self.control_array.shape[0] - 1
             logger.debug(f"Deleting control_point[{i}]. Last index: {i_last}.")
             if i != i_last:
@@ -307,9 +460,11 @@ class VolumeMaskTPS:
                 # Replace the deleted row with the last row so we can crop off the end.
                 self.control_points[i] = self.control_points[i_last]
                 self.control_array[i] = self.control_array[i_last]
+                self._cp_index[id(self.control_points[i])] = i
             # ... and pop.
             self.control_points.pop()
-            self.control_array = self.control_array[:i_last, :]
+            self.control_array = self._control_buf[:i_last]
+            self._split_control_array()
             self.parameters = None
             self._reduce_progress(MaskUpdate.PARTIAL)
 
@@ -322,10 +477,11 @@ class VolumeMaskTPS:
         """
 
         with self.lock:
-            i = self.control_points.index(cp)
+            i = self._cp_index[id(cp)]
             logger.debug(f"Updating control_point[{i}].")
             a = np.array(cp.get_origin(), np.float32)
             self.control_array[i, :] = a
+            self._split_control_array()
             self.parameters = None
             self._reduce_progress(MaskUpdate.PARTIAL)
 
@@ -354,19 +510,24 @@ class VolumeMaskTPS:
 
             # We can do a partial update if the dimensions are the same, or no
             # update at all if the volume is in the same location as the last.
-            same_volume: np.bool_ = np.bool_(
-                np.all(v_dims == self.v_dims)
-                and np.all(v_offset == self.v_offset)
-                and np.all(v_scale == self.v_scale)
-            )
+            v_dims_t = tuple(v_dims.tolist())
+            v_offset_t = tuple(v_offset.tolist())
+            v_scale_t = tuple(v_scale.tolist())
+            same_dims = v_dims_t == self._v_dims_t
+            same_volume = (same_dims
+                           and v_offset_t == self._v_offset_t
+                           and v_scale_t == self._v_scale_t)
             if not same_volume:
                 self._reduce_progress(
                     MaskUpdate.PARTIAL
-                    if np.all(v_dims == self.v_dims)
+                    if same_dims
                     else MaskUpdate.FULL)
                 self.v_dims = v_dims
                 self.v_offset = v_offset
                 self.v_scale = v_scale
+                self._v_dims_t = v_dims_t
+                self._v_offset_t = v_offset_t
+                self._v_scale_t = v_scale_t
 
     # The constant NxN number of vertices to construct a mesh out of.
     N_MESH: int = 16
@@ -391,32 +552,24 @@ class VolumeMaskTPS:
             # World coordinates.
             i_lower = self.v_offset[ia]
             i_upper = i_lower + self.v_scale[ia] * self.v_dims[ia]
-            i_ctrl = self.control_array[:, ia]
-            parameters = self._fit()
+            fit = self._fit()
 
         # The rest of this doesn't need to be locked.
 
         a0, a1 = _make_grid_axes(i_lower, i_upper, (self.N_MESH, self.N_MESH))
-        dep_var = _make_dep_var(a0, a1, parameters, i_ctrl)
+        dep_var = _make_dep_var(a0, a1, fit)
 
-        # Make a VTK mesh.
-        points = vtkPoints()
-        points.SetDataTypeToFloat()
-        points.SetNumberOfPoints(self.N_MESH * self.N_MESH)
-        if axis == 0:
-            for i in range(self.N_MESH):
-                for j in range(self.N_MESH):
-                    points.SetPoint(i * self.N_MESH + j, dep_var[j, i], a0[0, i], a1[j, 0])
-        elif axis == 1:
-            for i in range(self.N_MESH):
-                for j in range(self.N_MESH):
-                    points.SetPoint(i * self.N_MESH + j, a0[0, i], dep_var[j, i], a1[j, 0])
-        elif axis == 2:
-            for i in range(self.N_MESH):
-                for j in range(self.N_MESH):
-                    points.SetPoint(i * self.N_MESH + j, a0[0, i], a1[j, 0], dep_var[j, i])
-        else:
+        # Make a VTK mesh. Point [i * N_MESH + j] lies at grid position
+        # a0[i], a1[j], so the grid arrays are transposed to put "i" first.
+        if axis not in range(3):
             raise RuntimeError("Axis is outside range(3).")
+        xyz = np.empty((self.N_MESH, self.N_MESH, 3), np.float32)
+        xyz[:, :, axis] = dep_var.T
+        xyz[:, :, ia[0]] = a0.T
+        xyz[:, :, ia[1]] = a1.T
+        points = vtkPoints()
+        # The VTK array keeps a reference to the NumPy array it wraps.
+        points.SetData(numpy_to_vtk(xyz.reshape((-1, 3)), deep=False))
 
         mesh = vtkStructuredGrid()
         mesh_dims = [self.N_MESH] * 3
@@ -444,6 +597,44 @@ class VolumeMaskTPS:
 
         return actor
 
+    def _get_mask_grid(self) -> _MaskGrid:
+        """Get the layout of the mask grid, building it if it has changed.
+
+        You must hold "self.lock" while calling this method to avoid race
+        conditions.
+        """
+
+        key = (self._v_dims_t, self._v_offset_t, self._v_scale_t,
+               self.upscale, self.axis)
+        if self._mask_grid_key == key:
+            return self._mask_grid
+
+        v_dims_f = np.ceil(self.v_dims.astype(np.float32) / self.upscale)
+        v_dims = v_dims_f.astype(np.uint64)
+        # Since we adjusted the dims, the scale needs to be larger too.
+        # We would just multiply by `upscale`, but this avoids rounding error.
+        v_scale = self.v_scale * (self.v_dims.astype(np.float32) / v_dims_f)
+        axis = self.axis
+
+        ia = self._independent_axes()
+        # World coordinates.
+        i_lower = self.v_offset[ia]
+        i_step = v_scale[ia]
+        i_dims = v_dims[ia]
+        i_upper = i_lower + i_step * i_dims
+        a0, a1 = _make_grid_axes(i_lower, i_upper, i_dims)
+
+        self._mask_grid = _MaskGrid(
+            v_dims=v_dims,
+            a_offset=self.v_offset[axis],
+            a_scale=v_scale[axis],
+            a_dim=v_dims[axis],
+            a0=a0,
+            a1=a1,
+        )
+        self._mask_grid_key = key
+        return self._mask_grid
+
     def _make_mask(self) -> npt.NDArray[np.uint8]:
         """Generate the mask array.
 
@@ -466,35 +657,34 @@ class VolumeMaskTPS:
                 return self.mask
             self._mask_update = MaskUpdate.NONE
 
-            v_dims_f = np.ceil(self.v_dims.astype(np.float32) / self.upscale)
-            v_dims = v_dims_f.astype(np.uint64)
-            # Since we adjusted the dims, the scale needs to be larger too.
-            # We would just multiply by `upscale`, but this avoids rounding error.
-            v_scale = self.v_scale * (self.v_dims.astype(np.float32) / v_dims_f)
             axis = self.axis
-            a_offset = self.v_offset[axis]
-            a_scale = v_scale[axis]
-            a_dim = v_dims[axis]
-
-            ia = self._independent_axes()
-            i_ctrl = self.control_array[:, ia]
-            # World coordinates.
-            i_lower = self.v_offset[ia]
-            i_step = v_scale[ia]
-            i_dims = v_dims[ia]
-            i_upper = i_lower + i_step * i_dims
+            v_dims, a_offset, a_scale, a_dim, a0, a1 = self._get_mask_grid()
 
             # This operation is usually computationally cheap, and the other
             # thread will need this to be generated in any case.
-            parameters = self._fit()
+            fit = self._fit()
 
         logger.info(f"Rebuilding the spline grid for axis {axis}...")
-        a0, a1 = _make_grid_axes(i_lower, i_upper, i_dims)
-        dep_var = _make_dep_var(a0, a1, parameters, i_ctrl)
-        dep_indices = np.clip(
-            ((dep_var - a_offset) / a_scale).astype(np.int_),
-            0, a_dim
-        )
+        i_ctrl = fit.i_ctrl
+        phi_key = (i_ctrl.tobytes(), a0.tobytes(), a1.tobytes())
+        if self._phi_grid_key != phi_key:
+            self._phi_grid = None
+            self._phi_grid_key = None
+            if a0.size * a1.size * i_ctrl.shape[0] * 4 <= PHI_CACHE_BYTES:
+                self._phi_grid = _make_phi(a0, a1, i_ctrl)
+                self._phi_grid_key = phi_key
+        grid_shape = (a1.shape[0], a0.shape[1])
+        if self._dep_var is None or self._dep_var.shape != grid_shape:
+            self._dep_var = np.empty(grid_shape, np.float32)
+        dep_var = _make_dep_var(a0, a1, fit, self._phi_grid, out=self._dep_var)
+        # Convert to indices in place. Clipping before truncating gives the
+        # same indices as the other way around, and keeps out-of-range values
+        # from overflowing the 32-bit integers, which halve the memory
+        # traffic of the mask fill.
+        dep_var -= a_offset
+        dep_var /= a_scale
+        np.clip(dep_var, 0, float(a_dim), out=dep_var)
+        dep_indices = dep_var.astype(np.int32)
 
         if self.keep_greater_than:  # Only accessed once; is thread safe.
             fill_below = np.uint8(0)  # Transparent
@@ -524,57 +714,19 @@ class VolumeMaskTPS:
                 "dep_indices not previously set."
             assert self.dep_indices.shape == dep_indices.shape, \
                 "dep_indices not the same shape as the previous array."
-            if axis == 0:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        a = self.dep_indices[j, i]
-                        b = dep_indices[j, i]
-                        if a < b:
-                            self.mask[j, i, a:b] = fill_below
-                        else:
-                            self.mask[j, i, b:a] = fill_above
-            elif axis == 1:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        a = self.dep_indices[j, i]
-                        b = dep_indices[j, i]
-                        if a < b:
-                            self.mask[j, a:b, i] = fill_below
-                        else:
-                            self.mask[j, b:a, i] = fill_above
-            elif axis == 2:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        a = self.dep_indices[j, i]
-                        b = dep_indices[j, i]
-                        if a < b:
-                            self.mask[a:b, j, i] = fill_below
-                        else:
-                            self.mask[b:a, j, i] = fill_above
-            else:
-                raise RuntimeError(f"Axis {axis} not in [0, 1, 2].")
+            # Small nudges to the control points often round to the same
+            # indices, in which case the mask is already correct.
+            if np.array_equal(dep_indices, self.dep_indices):
+                logger.info("The surface indices are unchanged; keeping the mask.")
+                return self.mask
+            # Patching just the changed stretch of each column takes a
+            # Python loop over every column, with strided writes for the Y
+            # and Z axes. Refilling the whole mask in memory order is
+            # several times faster, even when little has changed.
+            _fill_mask(self.mask, dep_indices, axis, fill_below, fill_above)
         elif mask_update == MaskUpdate.FULL:
             logger.info("Starting a full mask update...")
-            # This is a very slow loop, on the order of 0.4 seconds. Ideally, it
-            # would be written in C++ for drastic speed-up, or, even better,
-            # pushed to the GPU.
-            if axis == 0:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        self.mask[j, i, :dep_indices[j, i]] = fill_below
-                        self.mask[j, i, dep_indices[j, i]:] = fill_above
-            elif axis == 1:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        self.mask[j, :dep_indices[j, i], i] = fill_below
-                        self.mask[j, dep_indices[j, i]:, i] = fill_above
-            elif axis == 2:
-                for i in range(i_dims[0]):
-                    for j in range(i_dims[1]):
-                        self.mask[:dep_indices[j, i], j, i] = fill_below
-                        self.mask[dep_indices[j, i]:, j, i] = fill_above
-            else:
-                raise RuntimeError(f"Axis {axis} not in [0, 1, 2].")
+            _fill_mask(self.mask, dep_indices, axis, fill_below, fill_above)
         else:
             raise RuntimeError(f"Unexpected value for mask_update: {mask_update}.")
 
@@ -582,6 +734,7 @@ class VolumeMaskTPS:
 
         # Update the cache.
         self.dep_indices = dep_indices
+        self._mask_version += 1
 
         return self.mask
 
@@ -598,10 +751,16 @@ class VolumeMaskTPS:
         # Only one thread is allowed to generate masks at a time.
         with self.get_vtk_lock:
             mask = self._make_mask()
+            if self.vtk_data is not None and self._vtk_data_version == self._mask_version:
+                logger.debug("The mask is unchanged; reusing the VTK data.")
+                return self.vtk_data
             vtk_array = vtkDataArray.CreateDataArray(VTK_UNSIGNED_CHAR)
             vtk_array.SetNumberOfComponents(1)
             vtk_array.SetNumberOfTuples(mask.size)
-            vtk_array.SetVoidArray(mask.ravel(), mask.size, 1)
+            # The mask is allocated C-contiguous, so this is a view and VTK
+            # reads the mask's own memory.
+            assert mask.flags.c_contiguous, "The mask must be C-contiguous."
+            vtk_array.SetVoidArray(mask.reshape(-1), mask.size, 1)
 
             self.vtk_data = vtkImageData()
             self.vtk_data.SetDimensions(mask.shape[::-1])
@@ -609,12 +768,14 @@ class VolumeMaskTPS:
             # By keeping a handle to the underlying array data, we can avoid
             # VTK access violations related to premature garbage collection.
             self.vtk_data._array_data = mask
+            self._vtk_data_version = self._mask_version
             return self.vtk_data
 
 
 def _radial_distance(
         x: npt.NDArray[np.float32],
-        ctrl_ind: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        ctrl_ind: npt.NDArray[np.float32],
+        out: Optional[npt.NDArray[np.float32]] = None) -> npt.NDArray[np.float32]:
     """Compute the pairwise radial distances of the given points to the
     control points.
 
@@ -625,14 +786,131 @@ def _radial_distance(
     :param x: (n, 2) matrix of points in the source space.
     :param ctrl_ind: (n_c, 2) matrix of control points representing the
         independent variables.
+    :param out: An (n, n_c) float32 array to write phi into, or None to
+        allocate a new one.
     :return: phi is the (n, n_c) matrix of radial distance from each point to a
         control point.
     """
 
-    dist_sq = cdist(x, ctrl_ind, metric="sqeuclidean")
-    dist_sq = dist_sq.astype(np.float32)
-    dist_sq[dist_sq == 0] = 1  # phi(0) = 0 by definition.
-    return dist_sq * np.log(dist_sq) / 2
+    # Expand |x - c|^2 = |x|^2 + |c|^2 - 2 x.c so that the bulk of the work
+    # is one matrix product, which NumPy hands to BLAS. Distances don't
+    # depend on where the origin is, so both sets of points are first
+    # centered on the control points to keep the cancellation error small.
+    center = ctrl_ind.mean(axis=0)
+    x = x - center
+    ctrl_ind = ctrl_ind - center
+    dist_sq = x @ (-2 * ctrl_ind.T)
+    dist_sq += np.einsum("ij,ij->i", x, x)[:, None]
+    dist_sq += np.einsum("ij,ij->i", ctrl_ind, ctrl_ind)[None, :]
+    # Rounding can leave tiny negative values where the points coincide.
+    # Clamping to a tiny positive value instead of zero keeps the log finite
+    # while still giving phi(0) = 0, as defined, to within float32 precision.
+    np.maximum(dist_sq, 1e-30, out=dist_sq)
+    phi = np.log(dist_sq, out=out)
+    phi *= dist_sq
+    phi *= 0.5
+    return phi
+
+
+def _update_radial_distance(
+        phi: Optional[npt.NDArray[np.float32]],
+        old_ind: Optional[npt.NDArray[np.float32]],
+        ctrl_ind: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    """Update the radial distances between the control points.
+
+    Only the rows and columns of the control points that were added or
+    moved since "phi" was computed are recomputed, so dragging a single
+    control point costs O(n) instead of O(n^2). When most of them changed,
+    the whole matrix is recomputed instead.
+
+    :param phi: The previous (m, m) result, which may be modified in place,
+        or None to compute it from scratch.
+    :param old_ind: The (m, 2) control points "phi" was computed for.
+    :param ctrl_ind: The (n, 2) control points representing the independent
+        variables.
+    :return: The (n, n) matrix of radial distances between control points.
+    """
+
+    n = ctrl_ind.shape[0]
+    if phi is None or old_ind is None:
+        return _radial_distance(ctrl_ind, ctrl_ind)
+
+    # Rows past the old end are new, and any others that differ have moved.
+    # Deleting swaps the last row into the gap, which shows up as a move.
+    k = min(old_ind.shape[0], n)
+    rows = np.concatenate((
+        np.flatnonzero(np.any(old_ind[:k] != ctrl_ind[:k], axis=1)),
+        np.arange(k, n),
+    ))
+    if 2 * rows.size > n:
+        return _radial_distance(ctrl_ind, ctrl_ind)
+
+    if phi.shape[0] != n:
+        kept = phi[:k, :k]
+        phi = np.empty((n, n), np.float32)
+        phi[:k, :k] = kept
+    if rows.size:
+        phi_rows = _radial_distance(ctrl_ind[rows], ctrl_ind)
+        phi[rows, :] = phi_rows
+        phi[:, rows] = phi_rows.T
+    return phi
+
+
+def _fill_mask(
+        mask: npt.NDArray[np.uint8],
+        dep_indices: npt.NDArray[np.int32],
+        axis: int,
+        fill_below: np.uint8,
+        fill_above: np.uint8) -> None:
+    """Fill the whole mask on either side of the clipping surface.
+
+    Each voxel is compared with the surface index of its column in a single
+    broadcast operation, so the work is done in NumPy rather than by looping
+    over the columns in Python. The comparison is written straight into the
+    mask, so no temporary arrays the size of the mask are needed. Large
+    masks are split into contiguous slabs of Z slices, filled in parallel.
+
+    :param mask: The mask array to fill. Shape: (Z, Y, X)
+    :param dep_indices: The index along the dependent axis where the surface
+        crosses each column of the mask. Shape: (i_dims[1], i_dims[0])
+    :param axis: The dependent axis.
+    :param fill_below: The value for voxels below the surface.
+    :param fill_above: The value for voxels at or above the surface.
+    """
+
+    # The mask is indexed [Z,Y,X], so its axes are in reverse order.
+    k = np.arange(mask.shape[2 - axis], dtype=np.int32)
+    if axis == 0:
+        k, dep_indices = k[None, None, :], dep_indices[:, :, None]
+    elif axis == 1:
+        k, dep_indices = k[None, :, None], dep_indices[:, None, :]
+    elif axis == 2:
+        k, dep_indices = k[:, None, None], dep_indices[None, :, :]
+    else:
+        raise RuntimeError(f"Axis {axis} not in [0, 1, 2].")
+
+    def fill_slab(z0: int, z1: int) -> None:
+        # Operands that broadcast along Z are shared by every slab.
+        k_slab = k if k.shape[0] == 1 else k[z0:z1]
+        dep_slab = dep_indices if dep_indices.shape[0] == 1 else dep_indices[z0:z1]
+        slab = mask[z0:z1]
+        # Each voxel becomes 1 below the surface and 0 otherwise. Multiplying
+        # by (below XOR above) and then XOR-ing with "above" maps these to the
+        # fill values without any chance of overflow.
+        np.less(k_slab, dep_slab, out=slab.view(np.bool_))
+        np.multiply(slab, fill_below ^ fill_above, out=slab)
+        if fill_above:
+            np.bitwise_xor(slab, fill_above, out=slab)
+
+    n_z = mask.shape[0]
+    n_slabs = min(MASK_FILL_THREADS, n_z)
+    if mask.size < MASK_FILL_MIN_VOXELS or n_slabs <= 1:
+        fill_slab(0, n_z)
+        return
+    bounds = [n_z * i // n_slabs for i in range(n_slabs + 1)]
+    with ThreadPoolExecutor(max_workers=n_slabs) as executor:
+        # Consume the results so that any exception is raised here.
+        list(executor.map(fill_slab, bounds[:-1], bounds[1:]))
 
 
 def _make_grid_axes(
@@ -644,39 +922,106 @@ def _make_grid_axes(
     :param lower: The lower bounds for the two independent variable axes.
     :param upper: The upper bounds for the two independent variable axes.
     :param dims: The size of the mask along the two independent variable axes.
-    :return: Two vectors of shape (1, dims[0]), and  with
+    :return: Two vectors of shape (1, dims[0]), and (dims[1], 1) with
         interpolated values between lower and upper.
     """
 
-    # The two independent axes in the world space make the grid.
-    a0 = np.linspace(lower[0], upper[0], dims[0], dtype=np.float32)
-    a1 = np.linspace(lower[1], upper[1], dims[1], dtype=np.float32)
-    a1, a0 = np.ix_(a1, a0)
+    # The two independent axes in the world space make the grid. Reshaping
+    # gives views with the broadcasting shapes, so nothing is copied.
+    a0 = np.linspace(lower[0], upper[0], dims[0], dtype=np.float32).reshape((1, -1))
+    a1 = np.linspace(lower[1], upper[1], dims[1], dtype=np.float32).reshape((-1, 1))
     return a0, a1
 
 
-def _make_dep_var(
+def _row_blocks(n_rows: int, n_cols: int) -> Iterator[tuple[int, int]]:
+    """Split the rows of a grid into blocks of about DEP_VAR_BLOCK_SIZE points.
+
+    :return: Iterates over the first row of each block and one past its last.
+    """
+
+    block_rows = max(1, DEP_VAR_BLOCK_SIZE // n_cols)
+    for r0 in range(0, n_rows, block_rows):
+        yield r0, min(r0 + block_rows, n_rows)
+
+
+def _grid_points(
+        a0: npt.NDArray[np.float32],
+        a1: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    """Resample the mesh grid as a series of points.
+
+    :param a0: The 1st array describing the points grid. Shape: (1, n_cols)
+    :param a1: The 2nd array describing the points grid. Shape: (n_rows, 1)
+    :return: The points of the grid, row by row. Shape: (n_rows*n_cols, 2)
+    """
+
+    p = np.empty((a1.shape[0], a0.shape[1], 2), dtype=np.float32)
+    p[:, :, 0] = a0
+    p[:, :, 1] = a1
+    return p.reshape((-1, 2))
+
+
+def _make_phi(
         a0: npt.NDArray[np.float32],
         a1: npt.NDArray[np.float32],
-        parameters: npt.NDArray[np.float32],
         i_ctrl: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    """Compute the radial distances from every point in the grid to the control points.
+
+    :param a0: The 1st array describing the points grid. Shape: (1, n_cols)
+    :param a1: The 2nd array describing the points grid. Shape: (n_rows, 1)
+    :param i_ctrl: The control array along the independent variable directions.
+    :return: phi for the grid, row by row. Shape: (n_rows*n_cols, n_c)
+    """
+
+    n_cols = a0.shape[1]
+    phi = np.empty((a1.shape[0] * n_cols, i_ctrl.shape[0]), np.float32)
+    for r0, r1 in _row_blocks(a1.shape[0], n_cols):
+        _radial_distance(_grid_points(a0, a1[r0:r1]), i_ctrl,
+                         out=phi[r0 * n_cols:r1 * n_cols])
+    return phi
+
+
+def _make_dep_var(
+        a0: npt.NDArray[np.float32],
+        a1: npt.NDArray[np.float32],
+        fit: _SplineFit,
+        phi: Optional[npt.NDArray[np.float32]] = None,
+        out: Optional[npt.NDArray[np.float32]] = None) -> npt.NDArray[np.float32]:
     """Compose the grid and evaluate the 2D spline for each point in it.
 
     :param a0: The 1st array describing the points grid. Shape: (1, i_dims[0])
     :param a1: The 2nd array describing the points grid. Shape: (i_dims[1], 1)
-    :param parameters: The thin plate spline parameters.
-    :param i_ctrl: The control array along the independent variable directions.
+    :param fit: The thin plate spline parameters.
+    :param phi: The radial distances for this grid from _make_phi, if known.
+        Otherwise, they are computed a block at a time as they are needed.
+    :param out: A C-contiguous float32 array of the grid's shape to write
+        the result into, or None to allocate a new one.
     :return: A 2D array of values representing the dependent variable.
     """
 
-    # Resample the mesh grid as a series of points.
-    p = np.empty((a1.shape[0], a0.shape[1], 2), dtype=np.float32)
-    p[:, :, 0] = a0
-    p[:, :, 1] = a1
-    p = p.reshape((-1, 2))
-
-    # Compute the dependent variable.
-    phi = _radial_distance(p, i_ctrl)
-    phi_1p = np.hstack((phi, np.ones((p.shape[0], 1)), p))
-    dep_var = (phi_1p @ parameters).reshape((a1.shape[0], a0.shape[1]))
+    n_rows = a1.shape[0]
+    n_cols = a0.shape[1]
+    # The spline is the sum of the radial terms, weighted by "alpha", and an
+    # affine term, b0 + b1*a0 + b2*a1. The affine term is evaluated on the
+    # grid axes directly by broadcasting.
+    alpha, (b0, b1, b2), i_ctrl = fit
+    dep_var = np.empty((n_rows, n_cols), np.float32) if out is None else out
+    b1_a0 = b1 * a0
+    b0_b2_a1 = b0 + b2 * a1
+    if phi is None:
+        # Each block's radial distances are written into the same buffer.
+        block_rows = max(1, DEP_VAR_BLOCK_SIZE // n_cols)
+        phi_buf = np.empty((min(block_rows, n_rows) * n_cols, i_ctrl.shape[0]), np.float32)
+    for r0, r1 in _row_blocks(n_rows, n_cols):
+        if phi is None:
+            phi_block = _radial_distance(
+                _grid_points(a0, a1[r0:r1]), i_ctrl,
+                out=phi_buf[:(r1 - r0) * n_cols])
+        else:
+            phi_block = phi[r0 * n_cols:r1 * n_cols]
+        # Whole rows of dep_var are contiguous, so the product can be
+        # written straight into them without any temporary arrays.
+        block = dep_var[r0:r1]
+        np.matmul(phi_block, alpha, out=block.reshape((-1, 1)))
+        block += b1_a0
+        block += b0_b2_a1[r0:r1]
     return dep_var
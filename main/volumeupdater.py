@@ -28,11 +28,12 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+import time
 from threading import (
-    Lock,
+    Condition,
+    Event,
     Thread,
 )
-from typing import Optional
 
 from main.scene import Scene
 from main.timeline import Timeline
@@ -40,6 +41,12 @@ from main.viewframe import ViewFrame
 
 logger = logging.getLogger(__name__)
 
+# Requests that arrive less than this many seconds apart are treated as a
+# burst, such as from dragging the timeline slider. During a burst, the
+# update waits until the requests have stopped for this long, so it loads
+# only the volume the burst ends on. Isolated requests start at once.
+QUEUE_SETTLE_TIME: float = 0.016
+
 
 class VolumeUpdater:
     """Updates the visible volume.
@@ -57,101 +64,150 @@ class VolumeUpdater:
         self.timeline = timeline
         self.scene = scene
 
-        # This is the thread that performs a volume update. When it
-        # finishes, it is destroyed and a new thread is eventually created.
-        self.thread: Optional[Thread] = None
-        # This lock prevents race conditions related to both multiple
-        # threads starting up and the must_update flag from being set
-        # when there is no living thread to carry out the request indicated.
-        self.load_lock = Lock()
+        # Guards the must_update flag and the busy event. The update thread
+        # waits on it for new requests, and wait_for_volume_update waits on
+        # it for the thread to finish. Only hold it while checking or
+        # setting those, since it has the potential to freeze the UI thread.
+        self.cv = Condition()
         self.must_update: bool = False
+        # When the last request was queued, by time.monotonic(), and whether
+        # it followed the one before closely enough to be part of a burst.
+        self._last_queue_time: float = -QUEUE_SETTLE_TIME
+        self._queue_burst: bool = False
+        # Set from when an update is requested until the thread has
+        # rendered the result and found no new request. The timeline's cache
+        # daemon holds off while this is set.
+        self.busy = Event()
+        # The thread that performs the volume updates. It lives for the
+        # whole session and sleeps while there is nothing to do, so there is
+        # no thread start-up cost for each update.
+        self.thread = Thread(target=self._run_thread, daemon=True)
+        self.thread.start()
         logger.debug("Initialized.")
 
-    def queue(self) -> None:
+    def queue(self, settle: bool = True) -> None:
         """Indicates that a new update is needed and returns immediately.
 
         When a volume update is requested while the previous update has yet
         to complete, this function indicates that a new update is needed and
         returns immediately to avoid bogging down the main loop with volume
-        loading operations.
+        loading operations. Requests made during an update are merged into
+        a single update once it completes.
 
-        This is the only function that is allowed to start the volume
-        updater thread. The volume updater thread can also recursively run
-        itself if still needed, as indicated by the must_update flag.
+        :param settle: Whether a request that closely follows the last one
+            may wait for a burst to settle. Pass false for requests that are
+            paced on purpose, such as autoplay frames, so fast playback is
+            not held back by QUEUE_SETTLE_TIME.
         """
 
-        # Use a lock so multiple queue requests don't race to create the
-        # update thread.
-        with self.load_lock:
+        with self.cv:
+            now = time.monotonic()
+            self._queue_burst = settle and now - self._last_queue_time < QUEUE_SETTLE_TIME
+            self._last_queue_time = now
             self.must_update = True
-
-            if not (self.thread and self.thread.is_alive()):
-                logger.info("New thread.")
-                # There is no thread, so start one.
-                self.thread = Thread(
-                    target=self._run_thread,
-                    daemon=True
-                )
-                self.thread.start()
-            else:
-                logger.info("Set the flag and returned.")
+            self.busy.set()
+            self.cv.notify_all()
+        logger.info("Set the flag and returned.")
 
     def _run_thread(self) -> None:
-        """The loop for the volume update thread.
-
-        This method will hold load_lock for as little time as possible since
-        this lock has the potential to freeze the UI thread. It should only
-        be held while checking and setting the must_update flag.
-        """
+        """The loop for the volume update thread."""
 
         try:
-            self.load_lock.acquire()
-            while self.must_update:
-                self.must_update = False
-                self.load_lock.release()
-
-                # Requesting a rendering should succeed even if there are no
-                # volumes available to render. Just do nothing.
-                if self.timeline:
-                    # This can be a time-consuming operation, during which,
-                    # the must_update flag may be changed.
-                    logger.info("Getting volume...")
-                    # Start the mask thread before getting the volume so
-                    # that both can run simultaneously. Store the index just
-                    # once to guard against race conditions.
-                    index = self.timeline.index
-                    volume = self.timeline.get(index, preload=False)
-                    mask_thread = self.scene.attach_mask(volume)
+            while True:
+                with self.cv:
+                    self.cv.wait_for(lambda: self.must_update)
+                try:
+                    self._update()
+                except Exception as e:
+                    # One bad volume must not stop the thread, since it is
+                    # never restarted.
+                    logger.exception(f"Thread error: {e}")
+                with self.cv:
+                    # A request raised while updating or rendering is handled
+                    # on the next pass, so the thread only goes idle without
+                    # one.
+                    if not self.must_update:
+                        self.busy.clear()
+                        self.cv.notify_all()
+        finally:
+            # Never leave the cache daemon and any waiters blocked on a
+            # thread that is gone.
+            with self.cv:
+                self.busy.clear()
+                self.cv.notify_all()
+
+    def _update(self) -> None:
+        """Show the current volume, repeating until no new update is requested."""
+
+        with self.cv:
+            self._wait_for_burst_to_settle()
+            self.must_update = False
+        while True:
+            # Requesting a rendering should succeed even if there are no
+            # volumes available to render. Just do nothing.
+            if self.timeline:
+                # This can be a time-consuming operation, during which,
+                # the must_update flag may be changed.
+                logger.info("Getting volume...")
+                # Queue the mask before getting the volume so
+                # that both can run simultaneously. Store the index just
+                # once to guard against race conditions.
+                index = self.timeline.index
+                volume = self.timeline.get(index, preload=False)
+                mask_done = self.scene.attach_mask(volume)
+                if self._is_stale(index):
+                    # Loading the data is the slow part, so skip it when
+                    # another volume has been requested in the meantime.
+                    # The mask updater also merges the requests, so it
+                    # can be left to pick up the next volume.
+                    logger.info(f"Skipped loading stale volume {index}.")
+                else:
                     volume = self.timeline.get(index, preload=True)
                     self.view_frame.set_volume_input(volume)
                     self.scene.volume_update(volume)
-                    if mask_thread is not None:
+                    if mask_done is not None:
                         logger.info("Waiting for mask to finish...")
-                        mask_thread.join()
+                        mask_done.wait()
 
-                self.load_lock.acquire()
+            with self.cv:
+                if not self.must_update:
+                    break
+                self._wait_for_burst_to_settle()
+                self.must_update = False
+
+        # Verify that the volume has been added to the renderer. Upon
+        # startup, this will not be the case. The volume cannot be added
+        # until it contains vtkImageData to render, or a non-fatal error
+        # will be thrown by the VTK pipeline.
+        self.view_frame.attach_volume()
+
+        # Request a rendering from the UI thread. We can't directly call
+        # the render function because it would happen outside the UI
+        # thread, which is illegal.
+        logger.info("Requesting render.")
+        self.view_frame.vtk_render()
 
-            # Verify that the volume has been added to the renderer. Upon
-            # startup, this will not be the case. The volume cannot be added
-            # until it contains vtkImageData to render, or a non-fatal error
-            # will be thrown by the VTK pipeline.
-            self.view_frame.attach_volume()
+    def _is_stale(self, index: int) -> bool:
+        """Whether a different volume than "index" has since been requested."""
 
-            # Request a rendering from the UI thread. We can't directly call
-            # the render function because it would happen outside the UI
-            # thread, which is illegal.
+        with self.cv:
+            return self.must_update and self.timeline.index != index
 
-            logger.info("Requesting render.")
-            self.view_frame.vtk_render()
+    def _wait_for_burst_to_settle(self) -> None:
+        """Wait until a burst of requests has stopped for QUEUE_SETTLE_TIME.
+
+        You must hold "self.cv" while calling this method. It is released
+        while waiting, so requests can still be queued.
+        """
 
-            # We can't release the load lock before this method returns or else
-            # a must_update flag may be raised and never acted upon.
-            self.load_lock.release()
-        except RuntimeError as e:
-            logger.exception(f"Thread error: {e}")
+        while self._queue_burst:
+            remaining = self._last_queue_time + QUEUE_SETTLE_TIME - time.monotonic()
+            if remaining <= 0:
+                break
+            self.cv.wait(timeout=remaining)
 
     def wait_for_volume_update(self) -> None:
         """Blocks until the volume update queue is empty."""
 
-        if self.thread is not None:
-            self.thread.join()
+        with self.cv:
+            self.cv.wait_for(lambda: not self.busy.is_set())
@@ -16,7 +16,7 @@
 
 import logging
 import random
-from threading import Thread
+from threading import Event
 from typing import (
     Any,
     Optional,
@@ -226,10 +226,11 @@ class ClippingSpline(SceneItem):
         self.mask.delete_cp(point)
         self.attach_mask()
 
-    def attach_mask(self, volume: Optional[VolumeImage] = None) -> Optional[Thread]:
-        """Start a thread to build and attach the mask to the viewer.
+    def attach_mask(self, volume: Optional[VolumeImage] = None) -> Optional[Event]:
+        """Queue the mask to be built and attached to the viewer.
 
-        Returns the thread so the caller can track progress, if applicable.
+        Returns an event that is set once the mask is attached, so the
+        caller can track progress, if applicable.
 
         This runs on either the VolumeUpdater or UI thread, so it offloads
         the heavy computation to the MaskUpdater thread. This is also
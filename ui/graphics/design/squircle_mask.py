@@ -1,12 +1,40 @@
 import numpy as np
 from PIL import Image
 
-t = np.linspace(-1, 1, 1024)
-x, y = np.meshgrid(t, t)
-
-p = 4
-r = (abs(x)**p + abs(y)**p)**(1/p)
+n = 1024
+p = 4  # Squircle exponent
 h = 80  # Edge hardness
-mask = np.clip((1 - r)*h, 0, 1)
-mask = (255 * mask).astype(np.uint8)
+
+# The mask is symmetric about both axes, so only the bottom-right quadrant
+# is computed and then mirrored into the others. Keep the same sample points
+# as the full linspace so the mirrored halves line up without a seam.
+t = np.linspace(-1, 1, n, dtype=np.float32)[n // 2:]
+
+# The outer sum of |t|**p along the two axes replaces a pair of meshgrids.
+# With p = 4, the power is just two squares and the root is two square
+# roots, which avoids the exp/log that np.power needs for fractional powers.
+if p == 4:
+    tp = t * t
+    tp *= tp
+else:
+    tp = np.power(t, p)
+q = np.empty((n // 2, n // 2), dtype=np.float32)
+np.add.outer(tp, tp, out=q)
+if p == 4:
+    np.sqrt(q, out=q)
+    np.sqrt(q, out=q)
+else:
+    np.power(q, np.float32(1 / p), out=q)
+# mask = clip((1 - r)*h, 0, 1), computed in place.
+np.multiply(q, -h, out=q)
+np.add(q, h, out=q)
+np.clip(q, 0, 1, out=q)
+np.multiply(q, 255, out=q)
+
+quadrant = q.astype(np.uint8)
+mask = np.empty((n, n), dtype=np.uint8)
+mask[n // 2:, n // 2:] = quadrant
+mask[n // 2:, :n // 2] = quadrant[:, ::-1]
+mask[:n // 2, n // 2:] = quadrant[::-1, :]
+mask[:n // 2, :n // 2] = quadrant[::-1, ::-1]
 Image.fromarray(mask).save("squircle_mask.png")